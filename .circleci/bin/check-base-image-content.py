@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Check that a published base image was built from the current Dockerfile of
+its distribution, by its content hash label, or print the content hash to
+build it with.
+
+    .circleci/bin/check-base-image-content.py bullseye quay.io/astronomer/ap-airflow-base:bullseye-2
+    .circleci/bin/check-base-image-content.py bullseye   # Print the content hash
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from common import get_base_image_content_hash  # noqa: E402
+
+CONTENT_HASH_LABEL = "io.astronomer.docker.base.content_hash"
+
+
+def label(image_name, name):
+    """The value of a label of a local image, empty if it doesn't have it"""
+    output = subprocess.check_output(
+        ["docker", "image", "inspect", "--format", f'{{{{ index .Config.Labels "{name}" }}}}', image_name],
+        text=True,
+    )
+    return output.strip().replace("<no value>", "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("distribution", help="The distribution of the base image, e.g. bullseye")
+    parser.add_argument("image", nargs="?", help="The local base image to check")
+    args = parser.parse_args()
+
+    expected = get_base_image_content_hash(args.distribution)
+    if not args.image:
+        print(expected)
+        return 0
+
+    found = label(args.image, CONTENT_HASH_LABEL)
+    if found != expected:
+        print(
+            f"{args.image} has content hash {found or 'none'}, but common/Dockerfile.base-{args.distribution} "
+            f"hashes to {expected}. "
+            "Published base images are never rebuilt, please bump its version in BASE_IMAGE_MAP "
+            "in .circleci/common.py.",
+            file=sys.stderr,
+        )
+        return 1
+    print(f"{args.image} was built from the current common/Dockerfile.base-{args.distribution}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Check that built images share the layers of their base image byte for byte,
+so a node that already has one of them only pulls the Airflow layers of the
+others.
+
+    .circleci/bin/check-base-image-layers.py quay.io/astronomer/ap-airflow-base:bullseye-2 \\
+        ap-airflow:2.3.3 ap-airflow:main
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+def layers(image_name):
+    """The digests of the layers of a local image, bottom first"""
+    output = subprocess.check_output(
+        ["docker", "image", "inspect", "--format", "{{json .RootFS.Layers}}", image_name]
+    )
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base_image", help="The shared base image")
+    parser.add_argument("images", nargs="+", help="Images that should build on the base image")
+    args = parser.parse_args()
+
+    base_layers = layers(args.base_image)
+    print(f"{args.base_image}: {len(base_layers)} layers")
+    failures = 0
+    for image_name in args.images:
+        image_layers = layers(image_name)
+        shared = 0
+        for base_layer, image_layer in zip(base_layers, image_layers):
+            if base_layer != image_layer:
+                break
+            shared += 1
+        if shared < len(base_layers):
+            found = image_layers[shared] if shared < len(image_layers) else "missing"
+            print(
+                f"{image_name}: layer {shared + 1} is {found}, "
+                f"not {base_layers[shared]} from {args.base_image}",
+                file=sys.stderr,
+            )
+            failures += 1
+        else:
+            own = len(image_layers) - shared
+            print(f"{image_name}: shares all {shared} base layers, plus {own} of its own")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(main())
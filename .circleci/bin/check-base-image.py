@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Check that the Dockerfile of every image in IMAGE_MAP builds on the shared
+base image of its distribution in BASE_IMAGE_MAP.
+
+    .circleci/bin/check-base-image.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from common import get_airflow_version, get_base_image, IMAGE_MAP, project_directory, read_files  # noqa: E402
+from dockerfile import Dockerfile, unquote  # noqa: E402
+
+
+def base_image_paths():
+    """Map the path of each Dockerfile that should build on a shared base image to that image"""
+    return {
+        os.path.join(project_directory, get_airflow_version(ac_version), distribution, "Dockerfile"):
+            get_base_image(distribution)
+        for ac_version, distributions in IMAGE_MAP.items()
+        for distribution in distributions
+        if get_base_image(distribution)
+    }
+
+
+def main():
+    expected = base_image_paths()
+    failures = 0
+    for path, contents in read_files(expected).items():
+        values = {
+            unquote(arg.value)
+            for arg in Dockerfile(contents, path).args
+            if arg.name == "APT_DEPS_IMAGE" and arg.value is not None
+        }
+        if values != {expected[path]}:
+            print(
+                f"{os.path.relpath(path, project_directory)} should build on {expected[path]}, "
+                f"please set ARG APT_DEPS_IMAGE=\"{expected[path]}\"",
+                file=sys.stderr,
+            )
+            failures += 1
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Check that every ARG in the given Dockerfiles is declared with the same value
+everywhere in that file.
+
+    .circleci/bin/check-different-arg-values.py 2.3.3/bullseye/Dockerfile main/bullseye/Dockerfile
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from common import read_files  # noqa: E402
+from dockerfile import Dockerfile, format_conflicts  # noqa: E402
+
+
+def main(filenames):
+    failures = 0
+    for path, contents in read_files(filenames).items():
+        conflicts = Dockerfile(contents, path).arg_conflicts()
+        if conflicts:
+            print(format_conflicts(path, conflicts), file=sys.stderr)
+            failures += len(conflicts)
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -9,6 +9,7 @@ testinfra simplifies and provides syntactic sugar for doing
 execs into a running container.
 """
 
+import json
 import os
 import docker
 import pytest
@@ -28,6 +29,8 @@ class ImageType(Enum):
 airflow_version = os.environ.get("AIRFLOW_VERSION")
 airflow_2 = True if airflow_version.startswith("2") else False
 is_edge_build = os.environ.get("EDGE_BUILD") == "true"
+# Images from 2.3.3 on ship with precompiled bytecode and a provider manifest
+optimized_startup = is_edge_build or semantic_version(airflow_version) >= semantic_version("2.3.3")
 
 
 def test_airflow_in_path(webserver):
@@ -318,6 +321,161 @@ def test_labels_for_onbuild_image(docker_client):
         "'maintainer' label should be 'Astronomer <humans@astronomer.io>'"
 
 
+def test_import_time_label(docker_client):
+    """ Ensure CI recorded how long 'import airflow' takes as a label """
+    import_time = get_label(docker_client, 'io.astronomer.docker.airflow.import_time_us')
+    assert int(import_time) > 0, "import time label should be a positive number of microseconds"
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on ship the dependency waiter")
+def test_dependency_waiter(docker_client):
+    """ Ensure the entrypoint's dependency waiter waits for a port to open, and gives up after its timeout """
+    # A fake database that only starts listening after a second, and a broker that never does
+    script = (
+        "import os, socket, subprocess, sys, threading, time\n"
+        "s = socket.socket(); s.bind(('127.0.0.1', 0)); port = s.getsockname()[1]\n"
+        "threading.Timer(1, s.listen).start()\n"
+        "c = socket.socket(); c.bind(('127.0.0.1', 0)); closed = c.getsockname()[1]; c.close()\n"
+        "env = dict(os.environ, DB=f'postgresql://u@127.0.0.1:{port}/db', BROKER=f'redis://127.0.0.1:{closed}/0')\n"
+        "waiter = [sys.executable, '-m', 'astronomer_dependency_waiter', '--timeout', '5']\n"
+        "assert subprocess.call(waiter + ['database=DB'], env=env) == 0\n"
+        "started = time.monotonic()\n"
+        "assert subprocess.call(waiter + ['database=DB', 'broker=BROKER'], env=env) == 1\n"
+        "assert 4 < time.monotonic() - started < 10\n"
+    )
+    docker_client.containers.run(
+        get_image_name(), entrypoint=["python", "-c", script], remove=True, network_mode="none"
+    )
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on ship the dependency waiter")
+def test_dependency_waiter_protocol_check(scheduler):
+    """ Ensure the dependency waiter's protocol check gets an answer to SELECT 1 from the metadata database """
+    output = scheduler.check_output(
+        "DB=${AIRFLOW__DATABASE__SQL_ALCHEMY_CONN:-$AIRFLOW__CORE__SQL_ALCHEMY_CONN} "
+        "python -m astronomer_dependency_waiter --check protocol --timeout 30 database=DB"
+    )
+    assert "Successfully connected to the database." in output
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on ship the dependency waiter")
+def test_dependency_waiter_protocol_check_timeout(docker_client):
+    """ Ensure the protocol check gives up at the timeout when the database accepts connections but never answers """
+    # The kernel completes the handshake for the listening socket, but nothing ever reads from it
+    script = (
+        "import os, socket, subprocess, sys, time\n"
+        "s = socket.socket(); s.bind(('127.0.0.1', 0)); s.listen(16); port = s.getsockname()[1]\n"
+        "env = dict(os.environ, DB=f'postgresql://u:p@127.0.0.1:{port}/db')\n"
+        "waiter = [sys.executable, '-m', 'astronomer_dependency_waiter', '--check', 'protocol', '--timeout', '3']\n"
+        "started = time.monotonic()\n"
+        "assert subprocess.call(waiter + ['database=DB'], env=env) == 1\n"
+        "elapsed = time.monotonic() - started\n"
+        "assert elapsed < 7, elapsed\n"
+    )
+    # libpq rounds a connect timeout below 2 seconds up to 2, so the last attempt can overrun a little
+    docker_client.containers.run(
+        get_image_name(), entrypoint=["python", "-c", script], remove=True, network_mode="none"
+    )
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on have an entrypoint fast path")
+def test_entrypoint_task_fast_path(docker_client):
+    """ Ensure task processes skip the dependency waits, even with a database that isn't there """
+    output = docker_client.containers.run(
+        get_image_name(),
+        ["airflow", "tasks", "run", "--help"],
+        environment={"AIRFLOW__DATABASE__SQL_ALCHEMY_CONN": "postgresql://u@127.0.0.1:1/db"},
+        network_mode="none",
+        remove=True,
+        stderr=True,
+    )
+    assert b'"path": "task"' in output
+    assert b"Waiting for database" not in output
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on time their startup")
+def test_entrypoint_timing(docker_client):
+    """ Ensure the entrypoint writes its startup phases as a JSON line and a Prometheus textfile """
+    output = docker_client.containers.run(
+        get_image_name(),
+        ["bash", "-c", "cat /tmp/entrypoint.prom >&2"],
+        environment={"ASTRONOMER_ENTRYPOINT_METRICS_FILE": "/tmp/entrypoint.prom"},
+        remove=True,
+        stdout=False,
+        stderr=True,
+    ).decode()
+    timing = json.loads(next(line for line in output.splitlines() if '"entrypoint_timing"' in line))
+    assert timing["path"] == "full"
+    assert timing["airflow_version"] == get_label(docker_client, 'io.astronomer.docker.airflow.version')
+    assert set(timing["phases_us"]) >= {"reexec", "config", "dependencies"}
+    assert timing["total_us"] >= sum(timing["phases_us"].values())
+    assert 'astronomer_entrypoint_duration_seconds{' in output
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on autotune to the container's limits")
+def test_entrypoint_autotune(docker_client):
+    """ Ensure ASTRONOMER_AUTOTUNE sizes the scheduler to the container's limits, but not over set options """
+    output = docker_client.containers.run(
+        get_image_name(),
+        ["airflow", "scheduler", "--help"],
+        # Set under its deprecated name
+        environment={"ASTRONOMER_AUTOTUNE": "true", "AIRFLOW__CORE__SQL_ALCHEMY_POOL_SIZE": "7"},
+        nano_cpus=2 * 10 ** 9,
+        mem_limit="4g",
+        remove=True,
+        stdout=False,
+        stderr=True,
+    ).decode()
+    assert "Autotune: 2000m CPU, 4096Mi memory" in output
+    assert "Autotune: AIRFLOW__SCHEDULER__PARSING_PROCESSES=2 " in output
+    assert "Autotune: AIRFLOW__CORE__SQL_ALCHEMY_POOL_SIZE is set explicitly" in output
+    assert "AIRFLOW__DATABASE__SQL_ALCHEMY_POOL_SIZE=" not in output
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on skip redundant permission syncs")
+def test_sync_perm_skipped_when_unchanged(webserver):
+    """ Ensure the entrypoint's permission sync is skipped when nothing changed since the last one """
+    webserver.check_output("python -m astronomer_sync_perm")
+    output = webserver.check_output("python -m astronomer_sync_perm")
+    assert "skipping airflow sync-perm" in output
+    output = webserver.check_output("ASTRONOMER_FORCE_SYNC_PERM=true python -m astronomer_sync_perm")
+    assert "skipping airflow sync-perm" not in output
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on build on a shared base image")
+def test_base_image_label(docker_client):
+    """ Ensure the image builds on a published version of the shared base image """
+    base_version = get_label(docker_client, 'io.astronomer.docker.base.version')
+    assert base_version.isdigit(), "base version label should be the version in BASE_IMAGE_MAP"
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on ship precompiled bytecode")
+def test_bytecode_is_precompiled(webserver):
+    """ Ensure installed packages ship hash-checked .pyc files, so they don't need compiling at startup """
+    # The flags field of a .pyc header is 0b11 for hash-based, checked against the source
+    flags = webserver.check_output(
+        "python -c \"import importlib.util, airflow; "
+        "f = open(importlib.util.cache_from_source(airflow.__file__), 'rb'); "
+        "f.read(4); print(int.from_bytes(f.read(4), 'little'))\""
+    )
+    assert flags.strip() == "3", "airflow should be precompiled with --invalidation-mode checked-hash"
+
+
+@pytest.mark.skipif(not optimized_startup, reason="Only images from 2.3.3 on ship a provider manifest")
+def test_provider_manifest(webserver):
+    """ Ensure providers are discovered from the baked manifest, and that it finds the same ones """
+    script = (
+        "from airflow.utils import entry_points; "
+        "patched = entry_points.entry_points_with_dist; "
+        "print(patched.__module__); "
+        "names = lambda f: sorted(d.metadata['Name'] for _, d in f('apache_airflow_provider')); "
+        "print(names(patched) == names(patched.__wrapped__))"
+    )
+    output = webserver.check_output(f'python -c "{script}"').split()
+    assert output == ["astronomer_provider_manifest", "True"], \
+        "Provider discovery should use the manifest and find the same providers"
+
+
 @pytest.mark.skipif(not is_edge_build, reason="Not needed for non-Edge/main builds")
 def test_labels_for_edge_builds(docker_client):
     # Note that this list does not include
@@ -397,6 +555,32 @@ def test_apache_airflow_in_requirements(tmp_path):
     assert output.returncode == 0, output.stderr
 
 
+@pytest.mark.skipif(not optimized_startup, reason="Only onbuild images from 2.3.3 on support a wheelhouse")
+def test_wheelhouse_install(tmp_path):
+    """
+    Test that requirements.txt installs from a wheelhouse built with build-wheelhouse, without the network
+    """
+    test_project = tmp_path / "test_project"
+    test_project.mkdir()
+    image_name = get_image_name(ImageType.ONBUILD.value)
+
+    (test_project / "Dockerfile").write_text(f"FROM {image_name}")
+    (test_project / "packages.txt").touch()
+    (test_project / "requirements.txt").write_text("boltons")
+    output = subprocess.run(
+        ['docker', 'run', '--rm', '--entrypoint', 'build-wheelhouse', '--user', f"{os.getuid()}:{os.getgid()}",
+         '-v', f"{test_project.resolve()}:/usr/local/airflow", image_name],
+        capture_output=True,
+    )
+    assert output.returncode == 0, output.stderr
+    assert list((test_project / "wheelhouse").glob("boltons-*.whl"))
+
+    output = subprocess.run(
+        ['docker', 'build', '--network', 'none', '-t', 'testimage', test_project.resolve()], capture_output=True
+    )
+    assert output.returncode == 0, output.stderr
+
+
 def test_airflow_in_constraints(scheduler):
     """
     Test that the installed Airflow version is added in constraints file to avoid accidental upgrades
@@ -3,11 +3,41 @@ Common utility functions for CircleCI configurator scripts
 """
 
 import collections
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 
 circle_directory = os.path.dirname(os.path.realpath(__file__))
-project_directory = os.path.join(circle_directory, "..")
+project_directory = os.path.normpath(os.path.join(circle_directory, ".."))
+
+
+def read_files(paths):
+    """Read all ``paths`` in parallel, returning a {path: contents} dict"""
+
+    def read(path):
+        with open(path) as f:
+            return f.read()
+
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor() as executor:
+        return dict(zip(paths, executor.map(read, paths)))
+
+
+def write_if_changed(path, contents):
+    """
+    Write ``contents`` to ``path``, unless the file already has exactly those contents.
+
+    Leaving unchanged files alone keeps their mtime, so Docker build contexts and
+    pre-commit caches stay valid. Returns True if the file was written.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == contents:
+                return False
+    with open(path, "w") as f:
+        f.write(contents)
+    return True
 
 
 def dev_releases(all_releases):
@@ -42,3 +72,30 @@ IMAGE_MAP = collections.OrderedDict([
 
 # Airflow Versions for which we don't publish Python Wheels
 DEV_ALLOWLIST = []
+
+# The version of the shared base image (common/Dockerfile.base-<distribution>) the Airflow images of a
+# distribution build on. Published base images are never rebuilt, bump the version to change one. CI fails
+# when the published image wasn't built from the current Dockerfile, see get_base_image_content_hash.
+BASE_IMAGE_REPO = "quay.io/astronomer/ap-airflow-base"
+BASE_IMAGE_MAP = collections.OrderedDict([
+    ("bullseye", "2"),
+])
+
+
+def get_base_image(distribution):
+    """Get the shared base image for a distribution, None if it doesn't have one"""
+    if distribution not in BASE_IMAGE_MAP:
+        return None
+    return f"{BASE_IMAGE_REPO}:{distribution}-{BASE_IMAGE_MAP[distribution]}"
+
+
+def get_base_image_content_hash(distribution):
+    """
+    Hash the instructions in the Dockerfile of a distribution's shared base image. Comments and blank
+    lines are left out, so edits that can't change the image (like the yearly copyright update) don't count.
+    """
+    path = os.path.join(project_directory, "common", f"Dockerfile.base-{distribution}")
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    instructions = "\n".join(line for line in lines if line and not line.startswith("#"))
+    return hashlib.sha256(instructions.encode()).hexdigest()
@@ -0,0 +1,140 @@
+"""
+A small Dockerfile model: every ARG, LABEL and FROM instruction indexed by
+build stage and line, so Dockerfiles can be checked and edited in one pass.
+"""
+
+import collections
+import re
+import shlex
+
+# A parsed ARG, LABEL or FROM. ``stage`` is the name (or index) of the build
+# stage it's in, None for ARGs before the first FROM, and ``line`` is 0-based.
+Instruction = collections.namedtuple("Instruction", "keyword name value stage line")
+
+INSTRUCTION_RE = re.compile(r"^\s*(?P<keyword>[A-Za-z]+)\s+(?P<rest>.*)$")
+ARG_RE = re.compile(r"^(?P<name>[A-Za-z_][A-Za-z0-9_]*)(?:=(?P<value>.*))?$")
+FROM_RE = re.compile(r"^(?:--\S+\s+)*(?P<image>\S+)(?:\s+as\s+(?P<name>\S+))?\s*$", re.IGNORECASE)
+
+
+def unquote(value):
+    """Strip one level of matching quotes from an ARG default"""
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def format_conflicts(path, conflicts):
+    """Explain the ARG conflicts found by Dockerfile.arg_conflicts"""
+    messages = []
+    for name, args in conflicts.items():
+        lines = "\n".join(f"{arg.line + 1}:ARG {arg.name}={arg.value}" for arg in args)
+        messages.append(
+            f"Found multiple ARG {name} in {path} with different values:\n{lines}\n\n"
+            f"Please update all ARG {name} directives to the same value in {path}."
+        )
+    return "\n".join(messages)
+
+
+class Dockerfile:
+    """
+    The ARG, LABEL and FROM instructions of a Dockerfile.
+
+    Continuation lines are joined to their instruction first, so nothing inside
+    a multi-line RUN is mistaken for an ARG, and multi-line LABELs are parsed.
+    """
+
+    def __init__(self, text, path=None):
+        self.path = path
+        self.lines = text.splitlines(keepends=True)
+        self.args = []
+        self.labels = []
+        self.froms = []
+
+        stage = None
+        for number, instruction in self._instructions():
+            match = INSTRUCTION_RE.match(instruction)
+            if not match:
+                continue
+            keyword, rest = match.group("keyword").upper(), match.group("rest").strip()
+
+            if keyword == "FROM":
+                from_match = FROM_RE.match(rest)
+                if from_match:
+                    stage = from_match.group("name") or len(self.froms)
+                    self.froms.append(Instruction("FROM", stage, from_match.group("image"), stage, number))
+            elif keyword == "ARG":
+                arg_match = ARG_RE.match(rest)
+                if arg_match:
+                    self.args.append(
+                        Instruction("ARG", arg_match.group("name"), arg_match.group("value"), stage, number)
+                    )
+            elif keyword == "LABEL":
+                try:
+                    pairs = shlex.split(rest)
+                except ValueError:
+                    continue
+                for pair in pairs:
+                    name, _, value = pair.partition("=")
+                    self.labels.append(Instruction("LABEL", name, value, stage, number))
+
+    def _instructions(self):
+        """Yield (first line, text) for every instruction, with continuation lines joined"""
+        start, parts = None, []
+        for number, line in enumerate(self.lines):
+            stripped = line.rstrip("\r\n")
+            if stripped.lstrip().startswith("#") or (not parts and not stripped.strip()):
+                continue
+            if not parts:
+                start = number
+            if stripped.endswith("\\"):
+                parts.append(stripped[:-1])
+                continue
+            parts.append(stripped)
+            yield start, " ".join(parts)
+            parts = []
+        if parts:
+            yield start, " ".join(parts)
+
+    @property
+    def text(self):
+        return "".join(self.lines)
+
+    @property
+    def stages(self):
+        """The names (or indexes) of the build stages, in order"""
+        return [instruction.stage for instruction in self.froms]
+
+    def arg_conflicts(self):
+        """
+        Map the name of every ARG that has more than one distinct default value
+        to its ARG instructions. ARGs that are redeclared without a value are fine.
+        """
+        defaults = collections.defaultdict(list)
+        for arg in self.args:
+            if arg.value is not None:
+                defaults[arg.name].append(arg)
+        return {
+            name: args
+            for name, args in defaults.items()
+            if len({unquote(arg.value) for arg in args}) > 1
+        }
+
+    def edit(self, arg_values, substitutions=()):
+        """
+        Return the text with every ARG in ``arg_values`` that has a default set
+        to the new value, and the ``substitutions`` ((regex, replacement) pairs)
+        applied to all other lines, in a single pass over the file.
+        """
+        arg_lines = {arg.line: arg for arg in self.args if arg.name in arg_values and arg.value is not None}
+        lines = []
+        for number, line in enumerate(self.lines):
+            if number in arg_lines:
+                arg = arg_lines[number]
+                ending = line[len(line.rstrip("\r\n")):]
+                indent = line[: len(line) - len(line.lstrip())]
+                line = f'{indent}ARG {arg.name}="{arg_values[arg.name]}"{ending}'
+            else:
+                for pattern, replacement in substitutions:
+                    line = pattern.sub(replacement, line)
+            lines.append(line)
+        return "".join(lines)
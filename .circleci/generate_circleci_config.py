@@ -2,8 +2,15 @@
 """
 This script is used to create the circle config file
 so that we can stay DRY.
+
+With --changed-from, only the images affected by the changes since that
+git ref are rendered, and the plan explaining why is printed to stderr.
 """
 
+import argparse
+import json
+import sys
+
 from jinja2 import Environment, FileSystemLoader
 
 from common import (
@@ -11,12 +18,15 @@ from common import (
     DEV_ALLOWLIST,
     dev_releases,
     get_airflow_version,
+    get_base_image,
     IMAGE_MAP,
     is_edge_build,
 )
+from plan_builds import changed_files_since, plan, planned_image_map
+from slim_report import has_slim_variant
 
 
-def generate_circleci_config():
+def generate_circleci_config(image_map=IMAGE_MAP):
     """
     Render the Jinja2 template file
     """
@@ -27,12 +37,43 @@ def generate_circleci_config():
     template_env.filters['is_edge_build'] = is_edge_build
     template = template_env.get_template("config.yml.j2")
 
+    # The shared base images the distributions in image_map build on
+    base_images = {
+        distribution: get_base_image(distribution)
+        for distributions in image_map.values()
+        for distribution in distributions
+        if get_base_image(distribution)
+    }
+
+    # The images that also get a slim variant built and tested
+    slim_variants = {
+        (ac_version, distribution)
+        for ac_version, distributions in image_map.items()
+        for distribution in distributions
+        if has_slim_variant(ac_version, distribution)
+    }
+
     config = template.render(
-        image_map=IMAGE_MAP,
+        image_map=image_map,
+        base_images=base_images,
+        slim_variants=slim_variants,
         dev_allowlist=DEV_ALLOWLIST,
     )
     print(config)
 
 
 if __name__ == "__main__":
-    generate_circleci_config()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--changed-from",
+        metavar="REF",
+        help="Only render the images affected by the changes since this git ref",
+    )
+    args = parser.parse_args()
+
+    if args.changed_from:
+        build_plan = plan(changed_files_since(args.changed_from))
+        print(json.dumps(build_plan, indent=2), file=sys.stderr)
+        generate_circleci_config(planned_image_map(build_plan))
+    else:
+        generate_circleci_config()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Work out which images in IMAGE_MAP are affected by a set of changed files,
+so CI only has to build, scan and test those.
+
+    .circleci/plan_builds.py master
+    .circleci/plan_builds.py --files 2.3.3/bullseye/Dockerfile common/Dockerfile.onbuild-buster
+"""
+
+import argparse
+import collections
+import fnmatch
+import json
+import subprocess
+
+from common import get_airflow_version, IMAGE_MAP, project_directory
+
+
+# Files that never end up in, or influence the testing of, an image
+IGNORED_PATTERNS = [
+    "*.md",
+    ".github/*",
+    ".gitignore",
+    ".pre-commit-config.yaml",
+    "CODEOWNERS",
+    "LICENSE",
+    "bench-repackage-providers.py",
+    "clean-artifacts.py",
+    "repackage-providers.py",
+]
+
+
+def image_pairs(image_map=IMAGE_MAP):
+    """All (ac_version, distribution) pairs in ``image_map``, in order"""
+    return [
+        (ac_version, distribution)
+        for ac_version, distributions in image_map.items()
+        for distribution in distributions
+    ]
+
+
+def affected_by(path, image_map=IMAGE_MAP):
+    """
+    Return a (rule, pairs) tuple: the (ac_version, distribution) pairs that
+    ``path`` affects, and a description of the rule that matched.
+    """
+    parts = path.split("/")
+    pairs = image_pairs(image_map)
+
+    if len(parts) > 2 and any(parts[0] == get_airflow_version(ac_version) for ac_version, _ in pairs):
+        selected = [
+            (ac_version, distribution)
+            for ac_version, distribution in pairs
+            if get_airflow_version(ac_version) == parts[0] and distribution == parts[1]
+        ]
+        if selected:
+            return "image build context", selected
+        return "distribution not in IMAGE_MAP", []
+
+    if any(fnmatch.fnmatch(path, pattern) for pattern in IGNORED_PATTERNS):
+        return "not an image input", []
+
+    if len(parts) > 1 and parts[0][0].isdigit():
+        # Files in version folders that aren't in IMAGE_MAP (anymore)
+        return "version not in IMAGE_MAP", []
+
+    if parts[0] == "common" and parts[-1].startswith("Dockerfile.onbuild-"):
+        distribution = parts[-1][len("Dockerfile.onbuild-"):]
+        return "onbuild image of the distribution", [pair for pair in pairs if pair[1] == distribution]
+
+    if parts[0] == "common" and parts[-1].startswith("Dockerfile.base-"):
+        distribution = parts[-1][len("Dockerfile.base-"):]
+        return "base image of the distribution", [pair for pair in pairs if pair[1] == distribution]
+
+    if parts[0] == "alpine-packages":
+        return "alpine packages", [pair for pair in pairs if pair[1].startswith("alpine")]
+
+    # .circleci/, common/, the trivy allowlist, and anything we don't know about
+    return "shared input", pairs
+
+
+def plan(changed_files, image_map=IMAGE_MAP):
+    """
+    Build the plan for ``changed_files``: which images to build and why.
+
+    Returns a dict with a "jobs" list of {ac_version, airflow_version,
+    distribution, reasons} and the "skipped" pairs and "ignored" files.
+    """
+    reasons = collections.OrderedDict((pair, []) for pair in image_pairs(image_map))
+    ignored = []
+
+    for path in changed_files:
+        rule, pairs = affected_by(path, image_map)
+        if not pairs:
+            ignored.append({"path": path, "rule": rule})
+        for pair in pairs:
+            reasons[pair].append({"path": path, "rule": rule})
+
+    return {
+        "changed_files": list(changed_files),
+        "jobs": [
+            {
+                "ac_version": ac_version,
+                "airflow_version": get_airflow_version(ac_version),
+                "distribution": distribution,
+                "reasons": pair_reasons,
+            }
+            for (ac_version, distribution), pair_reasons in reasons.items()
+            if pair_reasons
+        ],
+        "skipped": [
+            f"{ac_version}-{distribution}"
+            for (ac_version, distribution), pair_reasons in reasons.items()
+            if not pair_reasons
+        ],
+        "ignored": ignored,
+    }
+
+
+def planned_image_map(build_plan, image_map=IMAGE_MAP):
+    """The subset of ``image_map`` that ``build_plan`` selected, in the same order"""
+    selected = {(job["ac_version"], job["distribution"]) for job in build_plan["jobs"]}
+    planned = collections.OrderedDict()
+    for ac_version, distributions in image_map.items():
+        planned_distributions = [d for d in distributions if (ac_version, d) in selected]
+        if planned_distributions:
+            planned[ac_version] = planned_distributions
+    return planned
+
+
+def changed_files_since(ref):
+    """Files changed between the merge base of ``ref`` and HEAD, and in the working tree"""
+    merge_base = subprocess.check_output(
+        ["git", "merge-base", ref, "HEAD"], cwd=project_directory, text=True
+    ).strip()
+    output = subprocess.check_output(
+        ["git", "diff", "--name-only", "--no-renames", merge_base], cwd=project_directory, text=True
+    )
+    return sorted(set(output.splitlines()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("ref", nargs="?", help="Git ref to diff against, e.g. master")
+    group.add_argument("--files", nargs="+", help="Changed files, instead of asking git")
+    args = parser.parse_args()
+
+    changed_files = args.files or changed_files_since(args.ref)
+    print(json.dumps(plan(changed_files), indent=2))
+
+
+if __name__ == "__main__":
+    main()
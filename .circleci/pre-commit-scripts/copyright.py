@@ -2,34 +2,50 @@
 
 import argparse
 import re
+import sys
 from datetime import datetime
-from typing import Sequence, Optional
+from pathlib import Path
+from typing import Dict, List, Sequence, Optional
 
+repo_root = Path(__file__).parent.parent.parent.resolve()
 
-def main(argv: Optional[Sequence[str]] = None):
-    parser = argparse.ArgumentParser()
-    parser.add_argument("filenames", nargs="*", help="Filenames to check.")
-    args = parser.parse_args(argv)
+sys.path.insert(0, str(repo_root / ".circleci"))
+
+from common import read_files, write_if_changed  # noqa: E402
+
+
+def copyright_paths() -> List[str]:
+    """
+    The Dockerfiles that carry our copyright: the version/distro and common ones.
 
-    filenames = args.filenames
-    if not filenames:
-        from pathlib import Path
+    Only those folders are globbed, so alpine-packages/ and .git/ aren't walked.
+    """
+    assert (repo_root / "LICENSE").exists(), f"Not Repo Root. {repo_root}"
+    paths = list(repo_root.glob("*/*/Dockerfile*")) + list(repo_root.glob("common/Dockerfile*"))
+    return [str(path) for path in paths if path.relative_to(repo_root).parts[0] != "alpine-packages"]
 
-        repo_root = Path(__file__).parent.parent.parent.resolve()
-        assert (repo_root / "LICENSE").exists(), f"Not Repo Root. {repo_root}"
-        filenames = [f for f in repo_root.rglob("Dockerfile*")]
 
-    for filename in filenames:
-        with open(filename, "r") as file:
-            s = file.read()
-        ns = re.sub(
+def update_copyright(files: Dict[str, str]):
+    """Update the copyright year in each of the ``files`` ({path: contents})"""
+    for filename, s in files.items():
+        files[filename] = re.sub(
             r"# Copyright (\d{4}) Astronomer Inc.",
             f"# Copyright {datetime.now().year} Astronomer Inc.",
             s,
             flags=re.MULTILINE,
         )
-        with open(filename, "w") as file:
-            file.write(ns)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filenames", nargs="*", help="Filenames to check.")
+    args = parser.parse_args(argv)
+
+    files = read_files(args.filenames or copyright_paths())
+    update_copyright(files)
+    for filename, contents in files.items():
+        if write_if_changed(filename, contents):
+            print(f"Updated the copyright year in {filename}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Apply all the release bookkeeping in one go: the versions and constraints in
+the Dockerfiles, the CHANGELOG links in README.md and the copyright year.
+
+IMAGE_MAP is loaded once, every file is read once (in parallel) and edited in
+memory, and only files whose contents changed are written back.
+
+    .circleci/release.py
+    .circleci/release.py --check
+    .circleci/release.py --only dockerfiles
+"""
+
+import argparse
+import os
+import sys
+
+from common import circle_directory, project_directory, read_files, write_if_changed
+from update_dockerfiles import dockerfile_versions, update_dockerfiles
+from verify_changelog_entries import verification_paths, verify_changelog_entries
+
+sys.path.insert(0, os.path.join(circle_directory, "pre-commit-scripts"))
+
+from copyright import copyright_paths, update_copyright  # noqa: E402
+
+# name: (the files the step needs, the step that edits them in place)
+STEPS = {
+    "dockerfiles": (lambda: list(dockerfile_versions()), update_dockerfiles),
+    "changelogs": (verification_paths, verify_changelog_entries),
+    "copyright": (copyright_paths, update_copyright),
+}
+
+
+def release(steps=tuple(STEPS), write=True):
+    """
+    Run ``steps`` over the files they need and write back the ones that changed.
+
+    Returns the paths whose contents changed (and were written, if ``write``).
+    """
+    needed = {step: STEPS[step][0]() for step in steps}
+    original = read_files(path for paths in needed.values() for path in paths)
+    files = dict(original)
+    for step in steps:
+        # Each step only gets to see (and edit) the files it asked for
+        step_files = {path: files[path] for path in needed[step]}
+        STEPS[step][1](step_files)
+        files.update(step_files)
+
+    modified = [path for path, contents in files.items() if contents != original[path]]
+    if write:
+        for path in modified:
+            write_if_changed(path, files[path])
+    return modified
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=STEPS,
+        help="Only run this step, can be given more than once (default: all of them)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Don't write anything, exit with an error if any file would change",
+    )
+    args = parser.parse_args()
+
+    modified = release(args.only or tuple(STEPS), write=not args.check)
+    for path in modified:
+        print(f"{'Would modify' if args.check else 'Modified'} {os.path.relpath(path, project_directory)}")
+    if not modified:
+        print("Nothing to do, all files are up to date")
+    elif args.check:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Build the full and the slim variant of every image in IMAGE_MAP that has a
+slim one, and report how much smaller the slim image is than the full image
+built from the same tree, e.g.
+
+    .circleci/slim_report.py
+    .circleci/slim_report.py --no-build   # Only inspect images built before
+    .circleci/slim_report.py --baseline "quay.io/astronomer/ap-airflow-dev:{airflow_version}-{distribution}"
+
+With --baseline the slim image is also compared against a published image.
+The baseline is pulled, so it has to be an image from before the slim
+variant and the collapsed configuration layer, not a local build of this tree.
+"""
+
+import argparse
+import os
+import subprocess
+
+from common import get_airflow_version, IMAGE_MAP, project_directory, read_files
+from dockerfile import Dockerfile
+
+SLIM_STAGE = "slim-prune"
+
+
+def dockerfile_path(ac_version, distribution):
+    return os.path.join(project_directory, get_airflow_version(ac_version), distribution, "Dockerfile")
+
+
+def has_slim_variant(ac_version, distribution, contents=None):
+    """Whether the Dockerfile of the image has the stage the slim variant is built from"""
+    path = dockerfile_path(ac_version, distribution)
+    if contents is None:
+        contents = read_files([path])[path]
+    return SLIM_STAGE in Dockerfile(contents, path).stages
+
+
+def image_name(ac_version, distribution, slim=False):
+    """The local tag to build the full or the slim variant as"""
+    return f"ap-airflow:{get_airflow_version(ac_version)}-{distribution}" + ("-slim" if slim else "")
+
+
+def build(ac_version, distribution, name, slim=False):
+    build_args = ["--build-arg", f"SITE_PACKAGES_STAGE={SLIM_STAGE}"] if slim else []
+    subprocess.run(
+        [
+            "docker", "build", "--tag", name, *build_args,
+            os.path.dirname(dockerfile_path(ac_version, distribution)),
+        ],
+        check=True,
+    )
+
+
+def inspect(image_name):
+    """Return the (size in bytes, layer count) of a local image"""
+    output = subprocess.check_output(
+        ["docker", "image", "inspect", "--format", "{{.Size}} {{len .RootFS.Layers}}", image_name], text=True
+    )
+    size, layers = output.split()
+    return int(size), int(layers)
+
+
+def format_size(size):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def compare(before, after):
+    """Describe the difference between two (size in bytes, layer count) pairs"""
+    (before_size, before_layers), (after_size, after_layers) = before, after
+    saved = before_size - after_size
+    return (
+        f"{format_size(before_size)} -> {format_size(after_size)} "
+        f"(-{format_size(saved)}, {saved / before_size:.1%}), {before_layers} -> {after_layers} layers"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--no-build",
+        dest="build",
+        action="store_false",
+        help="Compare the full and slim images that are already built",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="TEMPLATE",
+        help="A published image to pull and compare the slim image against as well, {airflow_version} and "
+             "{distribution} are filled in",
+    )
+    args = parser.parse_args()
+
+    pairs = [(ac_version, distribution) for ac_version, distributions in IMAGE_MAP.items()
+             for distribution in distributions]
+    files = read_files(dockerfile_path(*pair) for pair in pairs)
+
+    rows = []
+    for ac_version, distribution in pairs:
+        if not has_slim_variant(ac_version, distribution, files[dockerfile_path(ac_version, distribution)]):
+            rows.append((ac_version, distribution, "n/a, no slim variant"))
+            continue
+
+        full_name = image_name(ac_version, distribution)
+        slim_name = image_name(ac_version, distribution, slim=True)
+        if args.build:
+            build(ac_version, distribution, full_name)
+            build(ac_version, distribution, slim_name, slim=True)
+        full, slim = inspect(full_name), inspect(slim_name)
+        summary = f"full {compare(full, slim)}"
+
+        if args.baseline:
+            baseline_name = args.baseline.format(
+                airflow_version=get_airflow_version(ac_version), distribution=distribution
+            )
+            if baseline_name in (full_name, slim_name):
+                parser.error(f"--baseline {baseline_name} is a local build of this tree")
+            subprocess.run(["docker", "pull", baseline_name], check=True)
+            summary += f"; baseline {compare(inspect(baseline_name), slim)}"
+        rows.append((ac_version, distribution, summary))
+
+    for ac_version, distribution, summary in rows:
+        print(f"{ac_version:<15} {distribution:<10} {summary}")
+
+
+if __name__ == "__main__":
+    main()
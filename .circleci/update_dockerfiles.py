@@ -6,73 +6,94 @@ This script is used to update the VERSION in all Dockerfiles with the correspond
 import os
 import re
 
-from common import DEV_ALLOWLIST, get_airflow_version, IMAGE_MAP, project_directory, is_edge_build
-from datetime import datetime
+from common import (
+    DEV_ALLOWLIST,
+    get_airflow_version,
+    IMAGE_MAP,
+    project_directory,
+    is_edge_build,
+    read_files,
+    write_if_changed,
+)
+from dockerfile import Dockerfile, format_conflicts
 
+CONSTRAINTS_URL_RE = re.compile(
+    r'https://raw.githubusercontent.com/apache/airflow/constraints-(.*)/constraints-(.*).txt'
+)
 
-def update_dockerfiles():
+
+def dockerfile_versions():
     """
-    Replace the VERSION in all the Dockerfiles with the corresponding VERSION in IMAGE_MAP
+    Map the path of each Dockerfile in IMAGE_MAP to its (ac_version, distros)
     """
+    dockerfiles = {}
     for ac_version, distros in IMAGE_MAP.items():
         if is_edge_build(ac_version):
             # We don't have a Changelog for edge builds
             continue
-        dev_version = False
         airflow_version = get_airflow_version(ac_version)
-        arg_ac_version = ac_version
-        if "dev" in ac_version:
-            dev_version = True
-            if airflow_version not in DEV_ALLOWLIST:
-                arg_ac_version = ac_version.replace("dev", "*")
-
         for distro in distros:
             file_name = os.path.join(project_directory, airflow_version, distro, "Dockerfile")
+            dockerfiles[file_name] = (ac_version, distros)
+    return dockerfiles
+
 
-            with open(file_name, 'r') as f:
-                file_contents = f.read()
+def update_dockerfile(file_contents, ac_version, distros, path="Dockerfile"):
+    """
+    Return ``file_contents`` with the VERSION, AIRFLOW_VERSION and constraints
+    URL matching ``ac_version``
+    """
+    dev_version = False
+    airflow_version = get_airflow_version(ac_version)
+    arg_ac_version = ac_version
+    if "dev" in ac_version:
+        dev_version = True
+        if airflow_version not in DEV_ALLOWLIST:
+            arg_ac_version = ac_version.replace("dev", "*")
 
-            # Replace AC Version
-            new_text = re.sub(
-                r'ARG VERSION=(.*)', f'ARG VERSION="{arg_ac_version}"', file_contents,
-                flags=re.MULTILINE
-            )
+    # Replace Moving Constraints Version to a tag for "non-dev" version (e.g constraints-2.1.0)
+    # For Dev versions we use a moving constraints branch (e.g constraints-2-1)
+    # We only do this for all buster images
+    # If it is the first post-fix version in AC / Airflow series use constraints-branch, if not
+    # use the constraints from Airflow Version tag.
+    if dev_version and "-1-dev" in ac_version:
+        branch = "-".join(airflow_version.split(".", 3)[0:2])
+        constraints_url = (
+            f'https://raw.githubusercontent.com/apache/airflow/constraints-{branch}/'
+            'constraints-${PYTHON_MAJOR_MINOR_VERSION}.txt'
+        )
+    else:
+        constraints_url = (
+            'https://raw.githubusercontent.com/apache/airflow/constraints-${AIRFLOW_VERSION}/'
+            'constraints-${PYTHON_MAJOR_MINOR_VERSION}.txt'
+        )
+    substitutions = []
+    if "alpine3.10" not in distros:
+        substitutions.append((CONSTRAINTS_URL_RE, constraints_url))
 
-            # Replace Airflow Version
-            new_text = re.sub(
-                r'ARG AIRFLOW_VERSION=(.*)',
-                f'ARG AIRFLOW_VERSION="{airflow_version}"',
-                new_text,
-                flags=re.MULTILINE
-            )
+    dockerfile = Dockerfile(file_contents, path)
+    arg_values = {"VERSION": arg_ac_version, "AIRFLOW_VERSION": airflow_version}
 
-            # Replace Moving Constraints Version to a tag for "non-dev" version (e.g constraints-2.1.0)
-            # For Dev versions we use a moving constraints branch (e.g constraints-2-1)
-            # We only do this for all buster images
-            # If it is the first post-fix version in AC / Airflow series use constraints-branch, if not
-            # use the constraints from Airflow Version tag.
-            if dev_version and "-1-dev" in ac_version:
-                branch = "-".join(airflow_version.split(".", 3)[0:2])
-                constraints_url = (
-                    f'https://raw.githubusercontent.com/apache/airflow/constraints-{branch}/'
-                    'constraints-${PYTHON_MAJOR_MINOR_VERSION}.txt'
-                )
-            else:
-                constraints_url = (
-                    'https://raw.githubusercontent.com/apache/airflow/constraints-${AIRFLOW_VERSION}/'
-                    'constraints-${PYTHON_MAJOR_MINOR_VERSION}.txt'
-                )
-            if "alpine3.10" not in distros:
-                new_text = re.sub(
-                    r'https://raw.githubusercontent.com/apache/airflow/constraints-(.*)/constraints-(.*).txt',
-                    constraints_url,
-                    new_text,
-                    flags=re.MULTILINE
-                )
+    # Any other ARG that is declared with different values is a mistake, the edit below only fixes these two
+    conflicts = {name: args for name, args in dockerfile.arg_conflicts().items() if name not in arg_values}
+    assert not conflicts, format_conflicts(path, conflicts)
 
-            with open(file_name, "w") as f:
-                f.write(new_text)
+    # Replace AC Version, Airflow Version and the constraints in a single pass
+    return dockerfile.edit(arg_values, substitutions)
+
+
+def update_dockerfiles(files):
+    """
+    Replace the VERSION in all the Dockerfiles in ``files`` ({path: contents})
+    with the corresponding VERSION in IMAGE_MAP
+    """
+    for file_name, (ac_version, distros) in dockerfile_versions().items():
+        files[file_name] = update_dockerfile(files[file_name], ac_version, distros, file_name)
 
 
 if __name__ == "__main__":
-    update_dockerfiles()
+    files = read_files(dockerfile_versions())
+    update_dockerfiles(files)
+    for file_name, contents in files.items():
+        if write_if_changed(file_name, contents):
+            print(f"Updated {os.path.relpath(file_name, project_directory)}")
@@ -7,13 +7,41 @@ links for all these CHANGELOG.md files in README.md
 import os
 import re
 
-from common import get_airflow_version, IMAGE_MAP, project_directory, is_edge_build
+from common import (
+    get_airflow_version,
+    IMAGE_MAP,
+    project_directory,
+    is_edge_build,
+    read_files,
+    write_if_changed,
+)
 
+README_PATH = os.path.join(project_directory, "README.md")
 
-def verify_changelog_entries():
+
+def changelog_paths():
+    """
+    Map the CHANGELOG.md path of each released version in IMAGE_MAP to its AC version
+    """
+    return {
+        os.path.join(project_directory, get_airflow_version(ac_version), "CHANGELOG.md"): ac_version
+        for ac_version in IMAGE_MAP
+        if not is_edge_build(ac_version) and "dev" not in ac_version
+    }
+
+
+def verification_paths():
+    """The files verify_changelog_entries needs: README.md and the changelogs that exist"""
+    return [README_PATH] + [path for path in changelog_paths() if os.path.exists(path)]
+
+
+def verify_changelog_entries(files):
     """
     Verify that CHANGELOG.md file has been created for each Airflow version. Also adds
     links for all these CHANGELOG.md files in README.md
+
+    ``files`` is a {path: contents} dict with README.md and the changelog_paths()
+    that exist, README.md is updated in it.
     """
     readme_changelog_links = (
         "## Changelog\n\n"
@@ -30,14 +58,11 @@ def verify_changelog_entries():
         if "dev" not in ac_version:
             # Check that Changelog entry for this Airflow Version has been created
             changelog_path = os.path.join(project_directory, airflow_version, "CHANGELOG.md")
-            assert os.path.exists(changelog_path), f"Please add the CHANGELOG.md file for {ac_version}"
-
-            with open(changelog_path) as changelog_file:
-                changelog_contents = changelog_file.read()
+            assert changelog_path in files, f"Please add the CHANGELOG.md file for {ac_version}"
 
-                # Replace AC Version
-                assert f"Astronomer Certified {ac_version}" in changelog_contents, \
-                    f"Please add Changelog entry for {ac_version} in {changelog_path}"
+            # Replace AC Version
+            assert f"Astronomer Certified {ac_version}" in files[changelog_path], \
+                f"Please add Changelog entry for {ac_version} in {changelog_path}"
 
         # Changelog Readme URL to include
         readme_changelog_links += (
@@ -46,18 +71,16 @@ def verify_changelog_entries():
         )
 
     # Update the Changelog URLs in README.md
-    with open(os.path.join(project_directory, "README.md"), "r") as readme_file:
-        readme_contents = readme_file.read()
-        new_readme_text = re.sub(
-            r'<!-- CHANGELOG START -->([\s\S]*)<!-- CHANGELOG END -->',
-            f'<!-- CHANGELOG START -->\n{readme_changelog_links}<!-- CHANGELOG END -->',
-            readme_contents,
-            flags=re.MULTILINE
-        )
-
-    with open(os.path.join(project_directory, "README.md"), "w") as readme_file:
-        readme_file.write(new_readme_text)
+    files[README_PATH] = re.sub(
+        r'<!-- CHANGELOG START -->([\s\S]*)<!-- CHANGELOG END -->',
+        f'<!-- CHANGELOG START -->\n{readme_changelog_links}<!-- CHANGELOG END -->',
+        files[README_PATH],
+        flags=re.MULTILINE
+    )
 
 
 if __name__ == "__main__":
-    verify_changelog_entries()
+    files = read_files(verification_paths())
+    verify_changelog_entries(files)
+    if write_if_changed(README_PATH, files[README_PATH]):
+        print("Updated README.md")
@@ -0,0 +1,186 @@
+"""
+Baked entry point manifest for Airflow provider and plugin discovery.
+
+Airflow finds providers and plugins through entry points, and
+``airflow.utils.entry_points.entry_points_with_dist`` reads the metadata of
+every installed distribution to find them, in every process it starts. The
+installed distributions only change at image build time, so
+
+    python -m astronomer_provider_manifest
+
+writes all entry points to a manifest, and the .pth file installed next to
+this module patches ``entry_points_with_dist`` to answer from that manifest
+instead.
+
+The manifest records a fingerprint of the *.dist-info/*.egg-info folders on
+sys.path. If packages were installed or upgraded since it was written (e.g.
+by ``pip install --user``) the fingerprint won't match, and Airflow's own
+discovery is used. Set ASTRONOMER_PROVIDER_MANIFEST to an empty value to turn
+the manifest off, or to a path to use another one.
+"""
+
+import os
+import sys
+
+DEFAULT_MANIFEST_PATH = "/usr/local/share/astronomer-provider-manifest.json"
+MANIFEST_VERSION = 1
+PATCHED_MODULE = "airflow.utils.entry_points"
+
+
+def manifest_path():
+    return os.environ.get("ASTRONOMER_PROVIDER_MANIFEST", DEFAULT_MANIFEST_PATH)
+
+
+def fingerprint(paths=None):
+    """Hash the names of the distribution metadata folders on ``paths`` (sys.path by default)"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    for path in sorted({os.path.abspath(path or ".") for path in (sys.path if paths is None else paths)}):
+        try:
+            names = sorted(name for name in os.listdir(path) if name.endswith((".dist-info", ".egg-info")))
+        except OSError:
+            continue
+        for name in names:
+            digest.update(f"{path}/{name}\n".encode())
+    return digest.hexdigest()
+
+
+def _metadata():
+    """The importlib.metadata implementation Airflow uses"""
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        from importlib import metadata
+    return metadata
+
+
+def build_manifest(metadata=None):
+    """
+    Collect the entry points of all installed distributions, by group, as
+    [name, value, distribution path] lists. Returns None if a distribution
+    with entry points can't be located on disk.
+    """
+    metadata = metadata or _metadata()
+    entry_points = {}
+    for dist in metadata.distributions():
+        path = getattr(dist, "_path", None)
+        dist_entry_points = list(dist.entry_points)
+        if dist_entry_points and path is None:
+            return None
+        for entry_point in dist_entry_points:
+            entry_points.setdefault(entry_point.group, []).append(
+                [entry_point.name, entry_point.value, os.path.abspath(str(path))]
+            )
+    return {"version": MANIFEST_VERSION, "fingerprint": fingerprint(), "entry_points": entry_points}
+
+
+def write_manifest(path=None):
+    import json
+
+    path = path or manifest_path()
+    manifest = build_manifest()
+    if manifest is None:
+        print("Some distributions can't be located on disk, not writing a manifest", file=sys.stderr)
+        if os.path.exists(path):
+            os.unlink(path)
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp_path, path)
+    groups = manifest["entry_points"]
+    print(f"Wrote {sum(map(len, groups.values()))} entry points in {len(groups)} groups to {path}")
+
+
+class _Manifest:
+    """The manifest, loaded (and checked against the installed distributions) on first use"""
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.metadata = metadata
+        self._entry_points = None
+        self._loaded = False
+        self._dists = {}
+
+    def entry_points(self):
+        """The entry points by group, or None if the manifest is missing or stale"""
+        if not self._loaded:
+            self._loaded = True
+            self._entry_points = self._load()
+        return self._entry_points
+
+    def _load(self):
+        import json
+
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("fingerprint") != fingerprint():
+            return None
+        return manifest["entry_points"]
+
+    def entry_points_with_dist(self, group):
+        import pathlib
+
+        result = []
+        for name, value, dist_path in self.entry_points().get(group, []):
+            if dist_path not in self._dists:
+                self._dists[dist_path] = self.metadata.PathDistribution(pathlib.Path(dist_path))
+            result.append((self.metadata.EntryPoint(name, value, group), self._dists[dist_path]))
+        return result
+
+
+def _patch(module):
+    """Make ``module.entry_points_with_dist`` answer from the manifest while it's valid"""
+    original = module.entry_points_with_dist
+    manifest = _Manifest(manifest_path(), module.metadata)
+
+    def entry_points_with_dist(group):
+        if manifest.entry_points() is None:
+            return original(group)
+        return manifest.entry_points_with_dist(group)
+
+    entry_points_with_dist.__doc__ = original.__doc__
+    entry_points_with_dist.__wrapped__ = original
+    module.entry_points_with_dist = entry_points_with_dist
+
+
+class _EntryPointsHook:
+    """A one-shot import hook that patches airflow.utils.entry_points once it's executed"""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != PATCHED_MODULE:
+            return None
+        sys.meta_path.remove(self)
+
+        import importlib.util
+
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def patched_exec_module(module):
+            exec_module(module)
+            try:
+                _patch(module)
+            except Exception as e:
+                print(f"Not using the provider manifest: {e}", file=sys.stderr)
+
+        spec.loader.exec_module = patched_exec_module
+        return spec
+
+
+def install():
+    """Called from the .pth file at interpreter startup, must stay cheap"""
+    if not manifest_path() or PATCHED_MODULE in sys.modules:
+        return
+    if not any(isinstance(finder, _EntryPointsHook) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _EntryPointsHook())
+
+
+if __name__ == "__main__":
+    write_manifest(sys.argv[1] if len(sys.argv) > 1 else None)
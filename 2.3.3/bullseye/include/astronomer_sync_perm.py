@@ -0,0 +1,132 @@
+"""
+Run ``airflow sync-perm`` only when something it syncs could have changed.
+
+Syncing permissions boots the whole webserver app and walks every role and
+DAG, which every webserver container used to do before starting. This
+fingerprints what the sync depends on (the Airflow and security manager
+versions, the DAG ids in the metadata database and the webserver
+configuration) and keeps the fingerprint of the last successful sync in the
+astronomer_entrypoint_state table of the metadata database, so
+
+    python -m astronomer_sync_perm
+
+skips the sync when nothing changed. Set ASTRONOMER_FORCE_SYNC_PERM=true to
+always sync. Whenever the fingerprint can't be computed or stored, it syncs.
+"""
+
+import hashlib
+import os
+import subprocess
+import sys
+
+STATE_TABLE = "astronomer_entrypoint_state"
+STATE_KEY = "sync_perm_fingerprint"
+DISTRIBUTIONS = ["apache-airflow", "astronomer-certified", "astronomer-fab-security-manager"]
+
+
+def _version(distribution):
+    try:
+        from importlib import metadata
+    except ImportError:
+        import importlib_metadata as metadata
+    try:
+        return metadata.version(distribution)
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+def webserver_config():
+    """The webserver settings roles depend on: webserver_config.py and [webserver] overrides"""
+    airflow_home = os.environ.get("AIRFLOW_HOME", os.path.expanduser("~/airflow"))
+    path = os.environ.get(
+        "AIRFLOW__WEBSERVER__CONFIG_FILE", os.path.join(airflow_home, "webserver_config.py")
+    )
+    try:
+        with open(path, "rb") as f:
+            contents = f.read()
+    except OSError:
+        contents = b""
+    env = sorted(
+        f"{key}={value}" for key, value in os.environ.items() if key.startswith("AIRFLOW__WEBSERVER__")
+    )
+    return contents, env
+
+
+def fingerprint(dag_ids):
+    digest = hashlib.sha256()
+    for distribution in DISTRIBUTIONS:
+        digest.update(f"{distribution}=={_version(distribution)}\n".encode())
+    contents, env = webserver_config()
+    digest.update(hashlib.sha256(contents).hexdigest().encode() + b"\n")
+    for line in env + sorted(dag_ids):
+        digest.update(f"{line}\n".encode())
+    return digest.hexdigest()
+
+
+class State:
+    """The astronomer_entrypoint_state key/value table in the metadata database"""
+
+    def __init__(self, url):
+        from sqlalchemy import Column, create_engine, MetaData, String, Table, Text
+        from sqlalchemy.pool import NullPool
+
+        self.engine = create_engine(url, poolclass=NullPool)
+        self.table = Table(
+            STATE_TABLE,
+            MetaData(),
+            Column("key", String(250), primary_key=True),
+            Column("value", Text),
+        )
+
+    def dag_ids(self):
+        from sqlalchemy import text
+
+        with self.engine.connect() as connection:
+            return [row[0] for row in connection.execute(text("SELECT dag_id FROM dag"))]
+
+    def get(self, key):
+        from sqlalchemy import inspect
+
+        with self.engine.connect() as connection:
+            if not inspect(connection).has_table(STATE_TABLE):
+                return None
+            row = connection.execute(self.table.select().where(self.table.c.key == key)).first()
+        return row[1] if row else None
+
+    def set(self, key, value):
+        with self.engine.begin() as connection:
+            self.table.create(connection, checkfirst=True)
+            connection.execute(self.table.delete().where(self.table.c.key == key))
+            connection.execute(self.table.insert().values(key=key, value=value))
+
+
+def main():
+    force = os.environ.get("ASTRONOMER_FORCE_SYNC_PERM", "").lower() in ("1", "true", "yes")
+    url = (
+        os.environ.get("AIRFLOW__DATABASE__SQL_ALCHEMY_CONN")
+        or os.environ.get("AIRFLOW__CORE__SQL_ALCHEMY_CONN")
+    )
+
+    state, current = None, None
+    if url:
+        try:
+            state = State(url)
+            current = fingerprint(state.dag_ids())
+            if not force and state.get(STATE_KEY) == current:
+                print("Permissions are in sync, skipping airflow sync-perm")
+                return 0
+        except Exception as e:
+            print(f"Couldn't compare the permissions fingerprint, syncing them: {e}", file=sys.stderr)
+            state = None
+
+    returncode = subprocess.call(["airflow", "sync-perm"])
+    if returncode == 0 and state is not None:
+        try:
+            state.set(STATE_KEY, current)
+        except Exception as e:
+            print(f"Couldn't store the permissions fingerprint: {e}", file=sys.stderr)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Prune what is never used at runtime from site-packages, for the slim variant.
+
+    python slim_prune.py SITE_PACKAGES [--keep-tests PACKAGE ...]
+
+Removes every ``tests``/``test`` folder, python package or not, and the
+``docs``/``doc`` folders that aren't python packages. The test packages of
+the top-level packages given with --keep-tests are kept, for the few
+distributions that import their own test modules at runtime.
+
+Before removing anything, every module that stays is checked for imports of
+a test package that would be removed. If there are any, nothing is removed
+and the build fails, so a missing --keep-tests entry can't ship a broken
+image.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+
+TEST_DIRS = {"tests", "test"}
+DOC_DIRS = {"docs", "doc"}
+IMPORT_RE = re.compile(
+    r"^\s*(?:from\s+(\.*[\w.]*)\s+import\s+\(?([\w., ]*)|import\s+([\w., ]+))", re.MULTILINE
+)
+
+
+def is_package(path):
+    return os.path.exists(os.path.join(path, "__init__.py"))
+
+
+def prunable(site_packages, keep_tests=()):
+    """The folders to remove, and the dotted names of the python packages among them"""
+    folders, packages = [], set()
+    for root, dirs, _ in os.walk(site_packages):
+        for name in list(dirs):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, site_packages).split(os.sep)
+            if name in TEST_DIRS and relative[0] not in keep_tests:
+                pass
+            elif name in DOC_DIRS and not is_package(path):
+                pass
+            else:
+                continue
+            dirs.remove(name)
+            folders.append(path)
+            if is_package(path):
+                packages.add(".".join(relative))
+    return folders, packages
+
+
+def imported_modules(path, source):
+    """The absolute dotted names of the modules ``source`` (the file at ``path``) imports"""
+    package = os.path.dirname(path).split(os.sep)
+    for match in IMPORT_RE.finditer(source):
+        base, names, plain = match.groups()
+        if plain:
+            yield from (name.split(" as ")[0].strip() for name in plain.split(","))
+            continue
+        module = base.lstrip(".")
+        dots = len(base) - len(module)
+        if dots:
+            parent = package[: len(package) - dots + 1]
+            module = ".".join(parent + ([module] if module else []))
+        yield module
+        # from package import tests
+        yield from (f"{module}.{name.split(' as ')[0].strip()}" for name in names.split(","))
+
+
+def runtime_imports_of(site_packages, folders, packages):
+    """Yield (file, module) for the files that stay and import one of the ``packages`` to be removed"""
+    removed = tuple(folder + os.sep for folder in folders)
+    for root, _, files in os.walk(site_packages):
+        if (root + os.sep).startswith(removed):
+            continue
+        for name in files:
+            # conftest.py files are only loaded by pytest
+            if not name.endswith(".py") or name == "conftest.py":
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8", errors="replace") as f:
+                source = f.read()
+            relative = os.path.relpath(path, site_packages)
+            for module in imported_modules(relative, source):
+                if any(module == package or module.startswith(package + ".") for package in packages):
+                    yield relative, module
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("site_packages")
+    parser.add_argument(
+        "--keep-tests",
+        nargs="*",
+        default=[],
+        metavar="PACKAGE",
+        help="Top-level packages whose test packages are imported at runtime",
+    )
+    args = parser.parse_args(argv)
+
+    folders, packages = prunable(args.site_packages, set(args.keep_tests))
+    imports = sorted(set(runtime_imports_of(args.site_packages, folders, packages)))
+    if imports:
+        for path, module in imports:
+            print(f"{path} imports {module}", file=sys.stderr)
+        print(
+            "These test packages are imported at runtime, add their top-level packages to SLIM_KEEP_TESTS",
+            file=sys.stderr,
+        )
+        return 1
+
+    for folder in folders:
+        shutil.rmtree(folder)
+    print(f"Removed {len(folders)} test and doc folders, {len(packages)} of them python packages")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
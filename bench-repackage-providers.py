@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+"""
+Offline benchmark for repackage-providers.py.
+
+Generates synthetic provider wheels, from tiny ones up to 50 MB with
+thousands of files, serves them from a local HTTP server, and measures
+wheels/s and MB/s of the rewrite, --local-dir and download paths. Results
+can be saved as a baseline and compared against on later runs.
+
+    ./bench-repackage-providers.py --save-baseline
+    ./bench-repackage-providers.py --jobs 4
+"""
+
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from rich.console import Console
+from rich.table import Table
+from tempfile import TemporaryDirectory
+from zipfile import ZIP_DEFLATED, ZipFile
+
+here = os.path.dirname(os.path.realpath(__file__))
+
+# The script's filename isn't a valid module name, so import it by path
+spec = importlib.util.spec_from_file_location(
+    "repackage_providers", os.path.join(here, "repackage-providers.py")
+)
+repackage_providers = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(repackage_providers)
+
+# name: (number of wheels, files per wheel, approximate uncompressed size of each wheel in bytes)
+PROFILES = {
+    "tiny": (20, 10, 20 * 1024),
+    "medium": (5, 500, 5 * 1024 * 1024),
+    "large": (2, 3000, 50 * 1024 * 1024),
+}
+
+SCENARIOS = ["rewrite", "local-dir", "download"]
+
+DEFAULT_BASELINE = os.path.join(here, ".benchmarks", "repackage-providers.json")
+
+
+def make_wheel(directory: str, name: str, version: str, files: int, size: int) -> str:
+    """Write a synthetic provider wheel, with a METADATA that requires apache-airflow"""
+    rng = random.Random(f"{name}-{version}-{files}-{size}")
+    dist_info = f"{name}-{version}.dist-info"
+    path = os.path.join(directory, f"{name}-{version}-py3-none-any.whl")
+    record = []
+
+    def add(wf, arcname, data):
+        wf.writestr(arcname, data)
+        digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=").decode("ascii")
+        record.append(f"{arcname},sha256={digest},{len(data)}")
+
+    with ZipFile(path, "w", ZIP_DEFLATED) as wf:
+        per_file = max(size // files, 64)
+        for i in range(files):
+            # Half source code that compresses well, half data that doesn't,
+            # like the bundled assets of the bigger providers
+            if i % 2:
+                data = rng.randbytes(per_file)
+            else:
+                line = f"def function_{i}(arg):  # {rng.random()}\n    return arg\n".encode()
+                data = line * (per_file // len(line) + 1)
+            add(wf, f"{name}/module_{i // 100}/file_{i}.py", data[:per_file])
+
+        metadata = (
+            "Metadata-Version: 2.1\n"
+            f"Name: {name.replace('_', '-')}\n"
+            f"Version: {version}\n"
+            "Requires-Python: ~=3.7\n"
+            "Requires-Dist: apache-airflow (>=2.2.0)\n"
+            "Requires-Dist: requests\n"
+            "\n"
+            "Synthetic provider package for benchmarks\n"
+        ).encode()
+        add(wf, f"{dist_info}/METADATA", metadata)
+        add(wf, f"{dist_info}/WHEEL", b"Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n")
+        entry_points = f"[apache_airflow_provider]\nprovider_info = {name}:info\n"
+        add(wf, f"{dist_info}/entry_points.txt", entry_points.encode())
+        record.append(f"{dist_info}/RECORD,,")
+        wf.writestr(f"{dist_info}/RECORD", "\n".join(record) + "\n")
+    return path
+
+
+def generate_wheels(directory: str, profiles) -> list:
+    wheels = []
+    for profile in profiles:
+        count, files, size = PROFILES[profile]
+        profile_dir = os.path.join(directory, profile)
+        os.makedirs(profile_dir, exist_ok=True)
+        for i in range(count):
+            name = f"apache_airflow_providers_bench_{profile}_{i}"
+            path = os.path.join(profile_dir, f"{name}-1.0.0-py3-none-any.whl")
+            if not os.path.exists(path):
+                make_wheel(profile_dir, name, "1.0.0", files, size)
+            wheels.append(path)
+    return wheels
+
+
+def serve(directory: str) -> ThreadingHTTPServer:
+    """Serve ``directory`` on a random local port, on a background thread"""
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_scenario(scenario: str, wheels: list, work_dir: str, base_url: str, jobs: int) -> float:
+    """Repack ``wheels`` once through ``scenario``, returning the seconds it took"""
+    with TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "output")
+        os.mkdir(output)
+        session = repackage_providers.make_session(jobs)
+        cache = repackage_providers.WheelCache(os.path.join(tmp, "cache"), session)
+
+        start = time.monotonic()
+        if scenario == "rewrite":
+            for wheel in wheels:
+                repackage_providers.rewrite_wheel(wheel, output, "1!1.0.0")
+        elif scenario == "local-dir":
+            results = repackage_providers.repack_wheels(output, wheels, cache, local=True, jobs=jobs)
+            for wheel, _, error in results:
+                if error:
+                    raise error
+        elif scenario == "download":
+            urls = [base_url + os.path.relpath(wheel, work_dir) for wheel in wheels]
+            for wheel, _, error in repackage_providers.repack_wheels(output, urls, cache, jobs=jobs):
+                if error:
+                    raise error
+        return time.monotonic() - start
+
+
+def comparable_results(baseline: dict, jobs: int, profiles, strict: bool) -> dict:
+    """
+    The results in ``baseline`` that were measured the same way as this run:
+    with the same --jobs, and with the same PROFILES entry. Anything else is
+    left out with a warning or, if ``strict``, is an error.
+    """
+
+    def mismatch(message):
+        if strict:
+            sys.exit(f"Can't compare against the baseline: {message}")
+        print(f"Warning: not comparing against the baseline, {message}", file=sys.stderr)
+
+    if not baseline:
+        return {}
+    if baseline.get("jobs") != jobs:
+        mismatch(f"it was saved with --jobs {baseline.get('jobs')}, not --jobs {jobs}")
+        return {}
+
+    results = dict(baseline["results"])
+    for profile in profiles:
+        saved = baseline.get("profiles", {}).get(profile)
+        if saved != list(PROFILES[profile]):
+            current = list(PROFILES[profile])
+            mismatch(f"the {profile} profile was {saved or 'not recorded'}, it is {current} now")
+            results = {key: result for key, result in results.items() if not key.startswith(f"{profile}/")}
+    return results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="--jobs to run repack_wheels with")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per scenario, the fastest one is kept",
+    )
+    parser.add_argument("--work-dir", help="Folder to keep generated wheels in between runs")
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help="Baseline results to compare against",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=None,
+        help="Exit with an error if MB/s dropped by more than this percentage compared to the baseline",
+    )
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        work_dir = args.work_dir or tmp
+        results = {}
+        for profile in args.profiles:
+            wheels = generate_wheels(work_dir, [profile])
+            total_bytes = sum(os.path.getsize(wheel) for wheel in wheels)
+            server = serve(work_dir)
+            base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+            try:
+                for scenario in args.scenarios:
+                    seconds = min(
+                        run_scenario(scenario, wheels, work_dir, base_url, args.jobs)
+                        for _ in range(args.repeat)
+                    )
+                    results[f"{profile}/{scenario}"] = {
+                        "wheels": len(wheels),
+                        "bytes": total_bytes,
+                        "seconds": seconds,
+                        "wheels_per_second": len(wheels) / seconds,
+                        "mb_per_second": total_bytes / 1e6 / seconds,
+                    }
+            finally:
+                server.shutdown()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    strict = args.max_regression is not None
+    baseline_results = comparable_results(baseline, args.jobs, args.profiles, strict)
+
+    table = Table(title=f"repackage-providers throughput (--jobs {args.jobs})")
+    for column in ("Benchmark", "Wheels", "MB", "Seconds", "Wheels/s", "MB/s", "vs baseline"):
+        table.add_column(column, justify="right")
+
+    regressions = []
+    for key, result in results.items():
+        change = "-"
+        if key in baseline_results:
+            pct = (result["mb_per_second"] / baseline_results[key]["mb_per_second"] - 1) * 100
+            change = f"{pct:+.1f}%"
+            if args.max_regression is not None and pct < -args.max_regression:
+                regressions.append(key)
+        table.add_row(
+            key,
+            str(result["wheels"]),
+            f"{result['bytes'] / 1e6:.1f}",
+            f"{result['seconds']:.3f}",
+            f"{result['wheels_per_second']:.1f}",
+            f"{result['mb_per_second']:.1f}",
+            change,
+        )
+    Console().print(table)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as fh:
+            baseline = {
+                "jobs": args.jobs,
+                "profiles": {profile: list(PROFILES[profile]) for profile in args.profiles},
+                "python": sys.version,
+                "results": results,
+            }
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        sys.exit(f"MB/s regressed by more than {args.max_regression}% for: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
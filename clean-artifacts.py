@@ -1,23 +1,283 @@
+from google.api_core import exceptions
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 import click
+import heapq
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".circleci"))
+
+from common import IMAGE_MAP, get_airflow_version  # noqa: E402
+
+# The client's own retry policy covers rate limiting (429), server side (5xx) errors and dropped or timed out
+# connections (requests, urllib3 and http.client errors), only its backoff and deadline are ours
+DELETE_RETRY = DEFAULT_RETRY.with_deadline(600.0).with_delay(initial=1.0, maximum=60.0, multiplier=2.0)
+
+# Only ask GCS for the fields we look at, rather than the full metadata of every blob
+LIST_FIELDS = "items(name,timeCreated,size),nextPageToken"
+LIST_PAGE_SIZE = 1000
+
+
+# The first X.Y.Z version in a blob name, up to the next "-" or "/" and without the file extension,
+# e.g. 2.3.3.dev20220801+astro.1 in astronomer_certified-2.3.3.dev20220801+astro.1-py3-none-any.whl
+VERSION_RE = re.compile(
+    r"(?<![\w.])(?P<series>\d+\.\d+\.\d+)[^-/]*?(?=(?:\.tar\.gz|\.zip|\.whl|\.build(?:\.json)?)?(?:[-/]|$))"
+)
+# The latest-<airflow version>.build(.json) files that dev image builds get their VERSION from
+LATEST_BUILD_RE = re.compile(r"(?:^|/)latest-(?P<series>[^/]+?)\.build(?P<json>\.json)?$")
+
+
+def list_dev_blobs(client, bucket_name, prefixes=(), match_glob=None):
+    """
+    Yield (prefix, blob) for every dev blob in the bucket.
+
+    The listing is narrowed down by GCS itself with ``prefixes`` and ``match_glob``
+    and only returns the fields in LIST_FIELDS. Pages are fetched as the
+    generator is consumed, so memory use doesn't grow with the bucket size.
+    """
+    # Prefixes that fall inside another one would list (and count) the same blobs twice
+    prefixes = sorted(set(prefixes)) or [""]
+    prefixes = [p for p in prefixes if not any(p != q and p.startswith(q) for q in prefixes)]
+
+    for prefix in prefixes:
+        blobs = client.list_blobs(
+            bucket_name,
+            prefix=prefix or None,
+            match_glob=match_glob,
+            fields=LIST_FIELDS,
+            page_size=LIST_PAGE_SIZE,
+        )
+        for blob in blobs:
+            if "dev" in blob.name:
+                yield prefix, blob
+
+
+def parse_artifact(name):
+    """
+    Split a blob name into its version series, full version and artifact kind.
+
+    The kind is the name with the version replaced by ``*``, so the wheels and
+    the sdists of a series are kept apart. Returns None for names without a version.
+    """
+    match = VERSION_RE.search(name)
+    if not match:
+        return None
+    return match.group("series"), match.group(0), name[: match.start()] + "*" + name[match.end() :]
+
+
+def open_dev_series():
+    """The Airflow versions of the -dev entries in IMAGE_MAP, e.g. {"2.3.3", "main"}"""
+    return {get_airflow_version(ac_version) for ac_version in IMAGE_MAP if "dev" in ac_version}
+
+
+def latest_build_versions(client, bucket_name):
+    """
+    Read the versions the latest-*.build(.json) files point at.
+
+    Those are the builds the open -dev entries in IMAGE_MAP are built from,
+    so they must never be deleted.
+    """
+    versions = set()
+    for blob in client.list_blobs(bucket_name, match_glob="**latest-*.build*", fields=LIST_FIELDS):
+        match = LATEST_BUILD_RE.search(blob.name)
+        if not match:
+            continue
+        content = blob.download_as_text()
+        if match.group("json"):
+            metadata = json.loads(content)
+            versions.add(metadata["output"]["astronomer_certified"]["package"]["version"])
+        else:
+            versions.add(content.strip())
+    return versions
+
+
+class RetentionPolicy:
+    """
+    Keep the ``keep`` newest blobs of each kind of artifact in a version series,
+    anything created after ``created_before`` and the builds in ``protected``.
+
+    Series that have an open -dev entry in IMAGE_MAP always keep at least their
+    newest build. latest-*.build files and names without a version are never deleted.
+    """
+
+    def __init__(self, keep, created_before, protected=(), open_series=()):
+        self.keep = keep
+        self.created_before = created_before
+        self.protected = set(protected)
+        self.open_series = set(open_series)
+        self.image_map_series = {get_airflow_version(ac_version) for ac_version in IMAGE_MAP}
+
+    def expired(self, blobs):
+        """
+        Yield the (prefix, blob) pairs from ``blobs`` that the policy doesn't keep,
+        in a single pass over the listing.
+
+        Only the ``keep`` newest blobs of each kind are held in memory: a blob that
+        drops out of them can't be among the newest anymore, so it is yielded
+        (and can be deleted) straight away.
+        """
+        newest = defaultdict(list)
+        for prefix, blob in blobs:
+            artifact = parse_artifact(blob.name)
+            if artifact is None or LATEST_BUILD_RE.search(blob.name):
+                continue
+            series, _, kind = artifact
+            keep = max(self.keep, 1) if self._is_open(series) else self.keep
+
+            heap = newest[series, kind]
+            heapq.heappush(heap, (blob.time_created, blob.name, prefix, blob))
+            if len(heap) > keep:
+                _, _, prefix, blob = heapq.heappop(heap)
+                if self._can_delete(blob):
+                    yield prefix, blob
+
+    def _is_open(self, series):
+        if series in self.open_series:
+            return True
+        # main-dev has no X.Y.Z of its own, its builds carry the version of the next release
+        return "main" in self.open_series and series not in self.image_map_series
+
+    def _can_delete(self, blob):
+        if blob.time_created >= self.created_before:
+            return False
+        return parse_artifact(blob.name)[1] not in self.protected
+
+
+def delete_blob(blob):
+    """
+    Delete a single blob, retrying with exponential backoff on 429/5xx.
+
+    Returns the number of bytes freed, or None if the blob was already gone.
+    """
+    try:
+        blob.delete(retry=DELETE_RETRY)
+    except exceptions.NotFound:
+        return None
+    return blob.size or 0
+
+
+def delete_old_dev_blobs(blobs, workers=16):
+    """
+    Delete the (prefix, blob) pairs from RetentionPolicy.expired, using a pool of
+    ``workers`` threads.
+
+    Returns a (deleted count, deleted bytes, already gone count, failed blob names)
+    tuple. Blobs that were gone already, e.g. deleted by an overlapping run, don't
+    count as deleted.
+    """
+    deleted = deleted_bytes = gone = 0
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def collect(done):
+            nonlocal deleted, deleted_bytes, gone
+            for future in done:
+                blob = pending.pop(future)
+                try:
+                    freed = future.result()
+                except Exception as e:
+                    click.echo(f"Failed to delete {blob.name}: {e}", err=True)
+                    failed.append(blob.name)
+                    continue
+                if freed is None:
+                    gone += 1
+                else:
+                    deleted += 1
+                    deleted_bytes += freed
+
+        for _, blob in blobs:
+            pending[executor.submit(delete_blob, blob)] = blob
+            # Keep the number of blobs held in memory bounded, the bucket can be huge
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(pending).done)
+
+    return deleted, deleted_bytes, gone, failed
+
+
+def report(blobs, prefixes):
+    """
+    Print the number and total size of the blobs that would be deleted, per prefix.
+
+    Without any --prefix the blobs are grouped by their top level folder.
+    """
+    counts = defaultdict(int)
+    sizes = defaultdict(int)
+    for prefix, blob in blobs:
+        if not prefixes:
+            prefix = blob.name.split("/", 1)[0] + "/" if "/" in blob.name else blob.name
+        counts[prefix] += 1
+        sizes[prefix] += blob.size or 0
+
+    width = max([len(prefix) for prefix in counts] + [len("Prefix")])
+    click.echo(f"{'Prefix':<{width}}  {'Blobs':>8}  {'MiB':>10}")
+    for prefix in sorted(counts):
+        click.echo(f"{prefix:<{width}}  {counts[prefix]:>8}  {sizes[prefix] / 1024 ** 2:>10.1f}")
+    click.echo(f"{'Total':<{width}}  {sum(counts.values()):>8}  {sum(sizes.values()) / 1024 ** 2:>10.1f}")
 
 
 @click.command()
 @click.argument("bucket_name")
-@click.option("--age", "-a", default=30, type=click.INT, help="Age in days")
-def delete_blobs(bucket_name, age):
+@click.option("--age", "-a", default=30, type=click.INT, help="Always keep blobs younger than this, in days")
+@click.option(
+    "--keep",
+    "-k",
+    default=3,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Number of newest builds to keep per version series",
+)
+@click.option("--workers", "-w", default=16, type=click.IntRange(min=1), help="Number of concurrent deletes")
+@click.option(
+    "--prefix",
+    "-p",
+    "prefixes",
+    multiple=True,
+    help="Only look at blobs under this prefix, can be given more than once",
+)
+@click.option(
+    "--match-glob",
+    default="**dev**",
+    show_default=True,
+    help="Only look at blobs whose name matches this glob, evaluated by GCS",
+)
+@click.option("--dry-run", is_flag=True, help="Only report what would be deleted, per prefix")
+def delete_blobs(bucket_name, age, keep, workers, prefixes, match_glob, dry_run):
     """
     This script helps to delete old blobs from GCS bucket.
 
-    python clean-artifacts.py <bucket_name> --age <age>
+    python clean-artifacts.py <bucket_name> --age <age> --keep <keep>
+
+    Set STORAGE_EMULATOR_HOST to run it against a local fake GCS server.
     """
     created_before = datetime.now(tz=timezone.utc) - timedelta(days=age)
     client = storage.Client()
-    blobs = client.list_blobs(bucket_name)
-    for blob in blobs:
-        if blob.time_created < created_before and "dev" in blob.name:
-            blob.delete()
+    policy = RetentionPolicy(
+        keep,
+        created_before,
+        protected=latest_build_versions(client, bucket_name),
+        open_series=open_dev_series(),
+    )
+    blobs = policy.expired(list_dev_blobs(client, bucket_name, prefixes, match_glob))
+    if dry_run:
+        report(blobs, prefixes)
+        return
+
+    deleted, deleted_bytes, gone, failed = delete_old_dev_blobs(blobs, workers)
+    click.echo(f"Deleted {deleted} blobs, {deleted_bytes / 1024 ** 2:.1f} MiB")
+    if gone:
+        click.echo(f"{gone} blobs were already gone")
+    if failed:
+        raise click.ClickException(f"Failed to delete {len(failed)} blobs")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+"""
+Wait for the services an Airflow component needs before starting it.
+
+/entrypoint runs
+
+    python -m astronomer_dependency_waiter database=AIRFLOW__DATABASE__SQL_ALCHEMY_CONN \\
+        broker=AIRFLOW__CELERY__BROKER_URL
+
+to wait for every ``name=ENV_VAR`` dependency at once, each URL read from the
+environment (so no credentials end up in the process list). Each one is
+polled in its own thread with jittered exponential backoff, so a cluster full
+of pods that restart together doesn't hammer a database that's down.
+
+By default a dependency is ready once its port accepts connections. With
+ASTRONOMER_DEPENDENCY_CHECK=protocol the database also has to answer a
+``SELECT 1``, a Redis broker a PING and an AMQP broker the protocol header.
+ASTRONOMER_DEPENDENCY_TIMEOUT is the number of seconds to wait for all of
+them, 0 (the default) waits forever. Exits with 1 if the timeout runs out.
+"""
+
+import argparse
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+DEFAULT_PORTS = {
+    "amqp": 5672,
+    "amqps": 5671,
+    "mssql": 1433,
+    "mysql": 3306,
+    "postgres": 5432,
+    "postgresql": 5432,
+    "pyamqp": 5672,
+    "redis": 6379,
+    "rediss": 6379,
+}
+
+# Seconds between attempts, doubling from the first to the last
+INITIAL_DELAY = 0.1
+MAX_DELAY = 5.0
+# Seconds a single connection attempt may take
+CONNECT_TIMEOUT = 2.0
+
+_print_lock = threading.Lock()
+
+
+def log(message):
+    with _print_lock:
+        print(message, flush=True)
+
+
+def parse_url(url):
+    """Return the (scheme, host, port) of a database or broker URL, host is None for ones without a server"""
+    # Celery takes a ;-separated list of failover brokers, the first one is the one it connects to
+    parts = urlsplit(url.split(";")[0].strip())
+    scheme = parts.scheme.split("+")[0].lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    return scheme, parts.hostname, port or DEFAULT_PORTS.get(scheme)
+
+
+def backoff_delays(initial=INITIAL_DELAY, maximum=MAX_DELAY):
+    """Exponentially growing delays, each picked at random from the upper half of its step"""
+    delay = initial
+    while True:
+        yield random.uniform(delay / 2, delay)
+        delay = min(delay * 2, maximum)
+
+
+def _recv_line(sock):
+    data = b""
+    while not data.endswith(b"\r\n"):
+        chunk = sock.recv(256)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def check_redis(sock, url):
+    """Send AUTH (if the URL has a password) and PING, and expect a PONG"""
+    parts = urlsplit(url)
+    commands = []
+    if parts.password:
+        auth = ["AUTH"] + ([unquote(parts.username)] if parts.username else []) + [unquote(parts.password)]
+        commands.append(auth)
+    commands.append(["PING"])
+    for command in commands:
+        request = f"*{len(command)}\r\n" + "".join(f"${len(arg.encode())}\r\n{arg}\r\n" for arg in command)
+        sock.sendall(request.encode())
+        reply = _recv_line(sock)
+        if not reply.startswith(b"+"):
+            raise ConnectionError(f"{command[0]} failed: {reply.decode(errors='replace').strip()}")
+    if reply.strip() != b"+PONG":
+        raise ConnectionError(f"unexpected reply to PING: {reply.decode(errors='replace').strip()}")
+
+
+def check_amqp(sock, url):
+    """Send the AMQP 0-9-1 protocol header, a broker answers with a Connection.Start method frame"""
+    sock.sendall(b"AMQP\x00\x00\x09\x01")
+    if sock.recv(1) != b"\x01":
+        raise ConnectionError("not an AMQP 0-9-1 broker")
+
+
+def sql_connect_args(scheme, timeout):
+    """The DBAPI connect() arguments that limit connecting to ``timeout`` seconds"""
+    if scheme in ("postgres", "postgresql", "mysql"):
+        # Both take whole seconds, libpq rounds anything below 2 up to 2
+        return {"connect_timeout": max(1, math.ceil(timeout))}
+    if scheme == "sqlite":
+        return {"timeout": timeout}
+    return {}
+
+
+class SqlCheck:
+    """Run SELECT 1 against the database"""
+
+    def __init__(self, url):
+        self.url = url
+        self.scheme = parse_url(url)[0]
+
+    def __call__(self, timeout=CONNECT_TIMEOUT):
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.pool import NullPool
+
+        # A new engine for every attempt, as the connect timeout shrinks with the time left
+        engine = create_engine(
+            self.url, poolclass=NullPool, connect_args=sql_connect_args(self.scheme, timeout)
+        )
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        finally:
+            engine.dispose()
+
+
+SOCKET_CHECKS = {
+    "amqp": check_amqp,
+    "pyamqp": check_amqp,
+    "redis": check_redis,
+}
+
+
+def attempt_timeout(deadline):
+    """The seconds a connection attempt may take, less than CONNECT_TIMEOUT if ``deadline`` is closer"""
+    if deadline is None:
+        return CONNECT_TIMEOUT
+    return max(min(CONNECT_TIMEOUT, deadline - time.monotonic()), 0.01)
+
+
+def wait_for(name, url, deadline=None, protocol=False):
+    """
+    Wait until the dependency at ``url`` is ready, or ``deadline`` (a
+    time.monotonic() value) passes. Returns whether it is ready.
+    """
+    scheme, host, port = parse_url(url)
+    if not host or not port:
+        log(f"Not waiting for the {name}, {scheme or 'its'} URL has no host and port to connect to")
+        return True
+
+    socket_check = SOCKET_CHECKS.get(scheme) if protocol else None
+    sql_check = SqlCheck(url) if protocol and name == "database" else None
+
+    log(f"Waiting for {name}: {host}:{port}")
+    attempts, error = 0, None
+    for delay in backoff_delays():
+        attempts += 1
+        try:
+            with socket.create_connection((host, port), timeout=attempt_timeout(deadline)) as sock:
+                if socket_check:
+                    socket_check(sock, url)
+            if sql_check:
+                sql_check(attempt_timeout(deadline))
+        except Exception as e:
+            error = e
+        else:
+            log(f"Successfully connected to the {name}.")
+            return True
+
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                log(f"Gave up waiting for the {name} at {host}:{port} after {attempts} attempts: {error}")
+                return False
+            delay = min(delay, remaining)
+        time.sleep(delay)
+
+
+def wait_for_all(dependencies, timeout=0, protocol=False, durations=None):
+    """
+    Wait for all ``dependencies`` ({name: url}) at once, returns whether all
+    of them are ready. Fills ``durations`` with the seconds each one took.
+    """
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    durations = {} if durations is None else durations
+    if not dependencies:
+        return True
+
+    def timed_wait_for(name, url):
+        started = time.monotonic()
+        try:
+            return wait_for(name, url, deadline, protocol)
+        finally:
+            durations[name] = time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=len(dependencies)) as executor:
+        futures = [executor.submit(timed_wait_for, name, url) for name, url in dependencies.items()]
+        return all(future.result() for future in futures)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "dependencies",
+        nargs="*",
+        metavar="NAME=ENV_VAR",
+        help="A dependency to wait for, and the environment variable with its URL. Unset ones are skipped.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=float(os.environ.get("ASTRONOMER_DEPENDENCY_TIMEOUT") or 0),
+        help="Seconds to wait for all dependencies, 0 waits forever "
+             "(default: $ASTRONOMER_DEPENDENCY_TIMEOUT)",
+    )
+    parser.add_argument(
+        "--check",
+        choices=["tcp", "protocol"],
+        default=os.environ.get("ASTRONOMER_DEPENDENCY_CHECK") or "tcp",
+        help="Wait for the port to open, or for the service to answer "
+             "(default: $ASTRONOMER_DEPENDENCY_CHECK)",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="Write how long each dependency took to PATH, as 'NAME MICROSECONDS' lines",
+    )
+    args = parser.parse_args(argv)
+
+    dependencies = {}
+    for dependency in args.dependencies:
+        name, sep, env_var = dependency.partition("=")
+        if not sep:
+            parser.error(f"{dependency} should be NAME=ENV_VAR")
+        if os.environ.get(env_var):
+            dependencies[name] = os.environ[env_var]
+
+    durations = {}
+    ready = wait_for_all(dependencies, args.timeout, args.check == "protocol", durations)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.writelines(f"{name} {round(seconds * 1e6)}\n" for name, seconds in durations.items())
+    return 0 if ready else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,123 +7,766 @@ from apache-airflow to astronomer-certified instead.
 
 from glob import glob
 
+import asyncio
+import collections
+import copy
+import csv
+import hashlib
+import html
+import io
+import json
+import math
 import os
+import queue
 import re
 import requests
 import rich
 import shutil
+import struct
+import sys
+import threading
+import time
 from argparse import ArgumentParser
+from base64 import urlsafe_b64encode
 from bs4 import BeautifulSoup
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
 from email.message import Message
 from email.parser import Parser
+from requests.adapters import HTTPAdapter
 from rich.console import Console
 from rich.table import Table
-from tempfile import TemporaryDirectory
-from urllib.parse import urljoin
-from wheel.cli.pack import pack as pack_wheel
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+from urllib.parse import quote, unquote, urljoin, urlsplit
 from wheel.wheelfile import WHEEL_INFO_RE
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo, sizeFileHeader
 
 
-def check_if_version_exists_in_astronomer_pip(package_name: str, version: str) -> bool:
+ASTRONOMER_PIP_INDEX = "https://pip.astronomer.io/simple/"
+
+DEFAULT_HTTP_ROOT = "https://dist.apache.org/repos/dist/release/airflow/providers/"
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "repackage-providers"
+)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+SDIST_RE = re.compile(r"^(?P<name>.+?)-(?P<ver>[^-]+?)\.(tar\.gz|zip)$")
+
+
+def canonicalize_name(name: str) -> str:
+    """Normalize a project name as described in PEP 503"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def strip_epoch(version: str) -> str:
+    """Drop the ``N!`` epoch we add when repackaging, e.g. ``1!2.0.0`` -> ``2.0.0``"""
+    return version.split("!", 1)[-1]
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """Create a requests Session whose connection pool is big enough for ``pool_size`` threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class PipelineTrace:
+    """
+    Timing and throughput of each stage of a run: ``listing``, ``check``,
+    ``download``, ``verify``, ``ingest``, ``rewrite`` and ``index``. The
+    ``metadata`` stage is the part of ``rewrite`` spent in update_metadata.
+
+    Every stage records the seconds it took and the bytes it processed.
+    Records are optionally written as JSON lines to ``--trace``, and are
+    summarised per stage (p50/p95 and MB/s) at the end of the run.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._fh = None
+
+    def open(self, path: str):
+        self._fh = open(path, "a", buffering=1)
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+    @contextmanager
+    def stage(self, stage: str, item: str, nbytes: int = 0):
+        """
+        Time the body of the ``with`` block as ``stage`` for ``item``. The
+        yielded dict's ``bytes`` can be updated once the size is known.
+        """
+        record = {"stage": stage, "item": item, "bytes": nbytes}
+        start = time.monotonic()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["seconds"] = time.monotonic() - start
+            record["time"] = time.time()
+            with self._lock:
+                self.records.append(record)
+                if self._fh:
+                    self._fh.write(json.dumps(record) + "\n")
+
+    def summary(self) -> Table:
+        table = Table(title="Time spent per stage")
+        for column in ("Stage", "Count", "Total s", "p50 s", "p95 s", "MB", "MB/s"):
+            table.add_column(column, justify="right")
+
+        stages: Dict[str, list] = collections.defaultdict(list)
+        for record in self.records:
+            stages[record["stage"]].append(record)
+
+        for stage, records in stages.items():
+            seconds = sorted(r["seconds"] for r in records)
+            total = sum(seconds)
+            mbytes = sum(r["bytes"] for r in records) / 1e6
+            table.add_row(
+                stage,
+                str(len(records)),
+                f"{total:.2f}",
+                f"{percentile(seconds, 50):.3f}",
+                f"{percentile(seconds, 95):.3f}",
+                f"{mbytes:.1f}",
+                f"{mbytes / total:.1f}" if total and mbytes else "-",
+            )
+
+        wall = time.monotonic() - self.started
+        mbytes = sum(r["bytes"] for r in stages.get("rewrite", [])) / 1e6
+        table.caption = (
+            f"{wall:.1f}s wall time, {mbytes:.1f} MB of wheels repackaged at {mbytes / wall:.1f} MB/s"
+        )
+        return table
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+trace = PipelineTrace()
+
+
+class PackageIndex:
     """
-    Check if a given provider with exact version exists in astronomer pip repo.
-    If it finds a provider with the same name and version, it will return True.
+    Client for a PEP 503 "simple" index, such as the Astronomer pip repo.
+
+    Each project page is fetched at most once per run over a shared, pooled
+    session. Pages are also cached on disk and revalidated with
+    ETag/If-Modified-Since, so repeated runs mostly get ``304 Not Modified``
+    back. Pages are parsed into an exact set of ``(name, version)`` pairs.
     """
-    url = "https://pip.astronomer.io/simple/" + package_name.replace("_", "-")
-    listing = requests.get(url)
-    # For New Providers we don't have a listing yet so it will fail with 404
-    if listing.status_code == 404:
-        return False
-    listing.raise_for_status()
-    soup = BeautifulSoup(listing.text, "html.parser")
-    return version in soup.text
 
+    def __init__(self, url: str, session: requests.Session, cache_dir: Optional[str] = None):
+        self.url = url if url.endswith("/") else url + "/"
+        self.session = session
+        self.cache_dir = cache_dir
+        self._projects: Dict[str, Set[Tuple[str, str]]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def has_version(self, package_name: str, version: str) -> bool:
+        """Check if a distribution with exactly this name and version is published"""
+        project = canonicalize_name(package_name)
+        return (project, strip_epoch(version)) in self.project_files(project)
+
+    def project_files(self, project: str) -> Set[Tuple[str, str]]:
+        """Return the ``(name, version)`` pairs of all files of ``project``"""
+        project = canonicalize_name(project)
+        with self._lock:
+            lock = self._locks.setdefault(project, threading.Lock())
+        with lock:
+            if project not in self._projects:
+                self._projects[project] = self._fetch(project)
+            return self._projects[project]
+
+    def _cache_path(self, project: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, "index", project + ".json")
+
+    def _fetch(self, project: str) -> Set[Tuple[str, str]]:
+        cache_path = self._cache_path(project)
+        cached = None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as fh:
+                cached = json.load(fh)
+
+        headers = {"Accept": "text/html"}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self.session.get(self.url + project + "/", headers=headers)
+        if response.status_code == 304 and cached:
+            return {tuple(pair) for pair in cached["files"]}
+        # For New Providers we don't have a listing yet so it will fail with 404
+        if response.status_code == 404:
+            return set()
+        response.raise_for_status()
+
+        files = parse_index_page(response.text)
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            entry = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "files": sorted(files),
+            }
+            with NamedTemporaryFile("w", dir=os.path.dirname(cache_path), delete=False) as fh:
+                json.dump(entry, fh)
+            os.replace(fh.name, cache_path)
+        return files
+
+
+def parse_index_page(page: str) -> Set[Tuple[str, str]]:
+    """Parse a PEP 503 project page into a set of ``(name, version)`` pairs"""
+    files = set()
+    soup = BeautifulSoup(page, "html.parser")
+    for a in soup.find_all("a", href=True):
+        filename = unquote(os.path.basename(urlsplit(a["href"]).path))
+        match = WHEEL_INFO_RE.match(filename) or SDIST_RE.match(filename)
+        if match:
+            files.add((canonicalize_name(match.group("name")), strip_epoch(match.group("ver"))))
+    return files
+
+
+class ListingCrawler:
+    """
+    Crawl one or more directory listings for wheels, e.g. the provider
+    release folder on dist.apache.org and the RC folders under it.
+
+    Listings are fetched concurrently on an asyncio event loop, with at most
+    ``max_connections`` requests in flight, and subdirectories are walked up
+    to ``max_depth`` levels deep. Only links below the listing they appear in
+    are followed. Wheels that match one of ``versions`` (any wheel, if none
+    are given) and that are not in ``index`` yet are emitted as soon as they
+    are found.
+    """
+
+    def __init__(self, index: PackageIndex, versions=(), max_connections: int = 8, max_depth: int = 3):
+        self.index = index
+        self.session = index.session
+        self.versions = [v for v in versions if v]
+        self.max_connections = max_connections
+        self.max_depth = max_depth
+
+    def wheel_urls(self, roots) -> Iterator[str]:
+        """
+        Run the crawl on a background thread and yield wheel URLs as they are
+        found, so the repack stage can start before the crawl is finished.
+        """
+        found: "queue.Queue" = queue.Queue()
+        done = object()
+
+        def run():
+            try:
+                asyncio.run(self.crawl(roots, found.put))
+            except BaseException as e:
+                found.put(e)
+            found.put(done)
+
+        threading.Thread(target=run, name="listing-crawler", daemon=True).start()
+        while True:
+            item = found.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def crawl(self, roots, emit: Callable[[str], None]):
+        """Crawl ``roots`` and call ``emit`` with the URL of every wheel that needs repackaging"""
+        semaphore = asyncio.Semaphore(self.max_connections)
+        seen: Set[str] = set()
+
+        async def get(url):
+            async with semaphore:
+                return await asyncio.to_thread(self._get, url)
+
+        async def check(url):
+            filename = wheel_filename(url)
+            match = WHEEL_INFO_RE.match(filename)
+            package_name = match.group("name")
+            package_version = match.group("ver")
+            async with semaphore:
+                published = await asyncio.to_thread(
+                    self._has_version, filename, package_name, package_version
+                )
+            if not published:
+                rich.print(f"{package_name}, {url}, {package_version}")
+                emit(url)
+
+        async def walk(url, depth):
+            listing_url, text = await get(url)
+            soup = BeautifulSoup(text, "html.parser")
+            tasks = []
+            for a in soup.find_all("a", href=True):
+                # Links may carry a #sha256= fragment, which we keep for the WheelCache
+                link = urljoin(listing_url, a["href"])
+                key = urlsplit(link)._replace(fragment="", query="").geturl()
+                if key in seen:
+                    continue
+                filename = wheel_filename(link)
+                if filename.endswith(".whl"):
+                    if not self.versions or any(v in filename for v in self.versions):
+                        seen.add(key)
+                        tasks.append(check(link))
+                elif key.endswith("/") and key.startswith(listing_url) and key != listing_url:
+                    if depth < self.max_depth:
+                        seen.add(key)
+                        tasks.append(walk(key, depth + 1))
+            await asyncio.gather(*tasks)
+
+        roots = [root if root.endswith("/") else root + "/" for root in roots]
+        seen.update(roots)
+        await asyncio.gather(*(walk(root, 0) for root in roots))
 
-def wheel_urls_from_listing(url, version):
-    listing = requests.get(url)
-    listing.raise_for_status()
-    soup = BeautifulSoup(listing.text, "html.parser")
+    def _get(self, url) -> Tuple[str, str]:
+        with trace.stage("listing", url) as record:
+            listing = self.session.get(url)
+            listing.raise_for_status()
+            record["bytes"] = len(listing.content)
+        return listing.url, listing.text
 
-    if version:
-        relative_wheels = [
-            a["href"] for a in soup.find_all("a") if a["href"].endswith(".whl") and version in a["href"]
-        ]
+    def _has_version(self, filename: str, package_name: str, package_version: str) -> bool:
+        with trace.stage("check", filename):
+            return self.index.has_version(package_name, package_version)
+
+
+def wheel_urls_from_listing(roots, versions, index: PackageIndex, max_connections: int = 8):
+    return ListingCrawler(index, versions, max_connections).wheel_urls(roots)
+
+
+def wheel_filename(url_or_path: str) -> str:
+    """The filename of a wheel URL or path, without any ``#sha256=`` fragment"""
+    return unquote(os.path.basename(urlsplit(url_or_path).path))
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(COPY_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class WheelCache:
+    """
+    Content-addressed cache of wheels, stored by their sha256.
+
+    Remote wheels are looked up by the ``#sha256=`` fragment of their URL when
+    the listing provides one, or else by the hash recorded for that URL on a
+    previous download. Interrupted downloads are resumed with HTTP Range
+    requests, and every wheel is verified against the expected hash before it
+    is handed to :func:`repack_wheel`. Local wheels are added to the same
+    store, so the URL and ``--local-dir`` modes share it.
+    """
+
+    def __init__(self, cache_dir: str, session: requests.Session):
+        self.root = os.path.join(cache_dir, "wheels")
+        self.session = session
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "sha256", sha256[:2], sha256)
+
+    def _url_key(self, url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.root, "urls", self._url_key(url))
+
+    def fetch(self, url: str) -> Tuple[str, str]:
+        """Return the path and sha256 of the cached wheel at ``url``, downloading it if needed"""
+        parts = urlsplit(url)
+        url = parts._replace(fragment="").geturl()
+        expected = None
+        if parts.fragment.startswith("sha256="):
+            expected = parts.fragment[len("sha256="):].lower()
+        elif os.path.exists(self._url_path(url)):
+            with open(self._url_path(url)) as fh:
+                expected = fh.read().strip()
+
+        if expected and os.path.exists(self.blob_path(expected)):
+            return self.blob_path(expected), expected
+
+        partial = os.path.join(self.root, "partial", self._url_key(url))
+        with trace.stage("download", wheel_filename(url)) as record:
+            record["bytes"] = self._download(url, partial)
+
+        with trace.stage("verify", wheel_filename(url), os.path.getsize(partial)):
+            sha256 = file_sha256(partial)
+        if parts.fragment.startswith("sha256=") and sha256 != expected:
+            os.unlink(partial)
+            raise ValueError(f"sha256 mismatch for {url}: expected {expected}, got {sha256}")
+
+        path = self._store(partial, sha256)
+        self._write(self._url_path(url), sha256)
+        return path, sha256
+
+    def add_local(self, path: str) -> Tuple[str, str]:
+        """Add a local wheel to the cache, returning its cached path and sha256"""
+        with trace.stage("ingest", wheel_filename(path), os.path.getsize(path)):
+            # Hash a private copy rather than the caller's file, which may be rewritten in place later
+            partial = os.path.join(self.root, "partial", f"local.{threading.get_ident()}")
+            os.makedirs(os.path.dirname(partial), exist_ok=True)
+            shutil.copyfile(path, partial)
+            sha256 = file_sha256(partial)
+            return self._store(partial, sha256), sha256
+
+    def _download(self, url: str, partial: str) -> int:
+        """Download ``url`` into ``partial``, resuming it if possible. Returns the bytes downloaded"""
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        validator_path = partial + ".validator"
+
+        headers = {}
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if offset and os.path.exists(validator_path):
+            with open(validator_path) as fh:
+                validator = fh.read().strip()
+            # If-Range makes the server send the whole file if it has changed
+            # since we started downloading it
+            headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+
+        with self.session.get(url, stream=True, headers=headers) as r:
+            if r.status_code == 416:
+                # The partial download is already complete
+                return 0
+            r.raise_for_status()
+            mode = "ab" if r.status_code == 206 else "wb"
+
+            validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+            if mode == "wb" and validator:
+                self._write(validator_path, validator)
+
+            downloaded = 0
+            with open(partial, mode) as f:
+                for chunk in r.iter_content(COPY_CHUNK_SIZE):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+
+        if os.path.exists(validator_path):
+            os.unlink(validator_path)
+        return downloaded
+
+    def _store(self, path: str, sha256: str) -> str:
+        """Move the file at ``path``, which the cache owns, into the store as ``sha256``"""
+        blob = self.blob_path(sha256)
+        if os.path.exists(blob):
+            os.unlink(path)
+            return blob
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(path, blob)
+        return blob
+
+    def _write(self, path: str, contents: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as fh:
+            fh.write(contents)
+        os.replace(fh.name, path)
+
+
+def repack_wheel(output: str, url_or_path: str, cache: WheelCache, local: bool = False) -> Tuple[str, str]:
+    """Repack a wheel, returning the path of the new wheel and the sha256 of the input wheel"""
+    if local:
+        src_filename, sha256 = cache.add_local(url_or_path)
     else:
-        relative_wheels = [a["href"] for a in soup.find_all("a") if a["href"].endswith(".whl")]
+        src_filename, sha256 = cache.fetch(url_or_path)
 
-    table = Table(title="Providers that needs to be repackaged")
-    table.add_column("Provider Name", justify="right", style="cyan", no_wrap=True)
-    table.add_column("URL", style="magenta")
-    table.add_column("Version", justify="right", style="green")
+    filename = wheel_filename(url_or_path)
+    ver = WHEEL_INFO_RE.match(filename).group("ver")
 
-    for relative_wheel in relative_wheels:
-        match = WHEEL_INFO_RE.match(relative_wheel)
-        package_name = match.group("name")
-        package_version = match.group("ver")
-        if not check_if_version_exists_in_astronomer_pip(package_name, package_version):
+    with trace.stage("rewrite", filename, os.path.getsize(src_filename)):
+        return rewrite_wheel(src_filename, output, "1!" + ver, filename), sha256
 
-            table.add_row(package_name, relative_wheel, package_version)
-            rich.print(f"{package_name}, {relative_wheel}, {package_version}")
 
-            yield urljoin(listing.url, relative_wheel)
+def rewrite_wheel(src_filename: str, output: str, ver: str, label: Optional[str] = None) -> str:
+    """
+    Stream the wheel at ``src_filename`` into a new wheel under ``output``,
+    with its METADATA rewritten by :func:`update_metadata`.
 
-    console = Console()
-    console.print(table)
+    Unchanged members are copied across as raw compressed bytes, without
+    decompressing them. Only METADATA and RECORD are regenerated, and the
+    ``.dist-info`` folder is renamed when the version changes. Returns the
+    path of the new wheel. ``label`` names the wheel in the trace.
+    """
+    label = label or os.path.basename(src_filename)
+    # We can't use WheelFile to read it, as the filename doesn't match
+    # always the contents (rc vs not)
+    with ZipFile(src_filename) as src:
+        dist_info = next(
+            name[: -len("/METADATA")]
+            for name in src.namelist()
+            if re.match(r"^[^/]+\.dist-info/METADATA$", name)
+        )
+        with trace.stage("metadata", label):
+            metadata, real_name, metadata_ver = update_metadata(src.read(f"{dist_info}/METADATA"), ver)
+        wheel_info = Parser().parsestr(src.read(f"{dist_info}/WHEEL").decode("utf-8"))
+
+        # Update the version in the .dist-info/ folder name, as this is what
+        # determines the filename of the wheel
+        new_dist_info = dist_info.replace(metadata_ver, ver) if metadata_ver != ver else dist_info
+
+        def rename(name):
+            if name.startswith(dist_info + "/"):
+                return new_dist_info + name[len(dist_info):]
+            return name
+
+        tags = wheel_info.get_all("Tag", [])
+        tagline = "-".join(".".join(sorted({tag.split("-")[i] for tag in tags})) for i in range(3))
+        namever = new_dist_info[: -len(".dist-info")]
+        if wheel_info["Build"]:
+            namever += "-" + wheel_info["Build"]
+
+        output = os.path.join(output, canonicalize_name(real_name))
+        os.makedirs(output, exist_ok=True)
+        wheel_path = os.path.join(output, f"{namever}-{tagline}.whl")
 
+        record = f"{dist_info}/RECORD"
+        with NamedTemporaryFile(dir=output, suffix=".whl.tmp", delete=False) as tmp:
+            try:
+                with ZipFile(tmp, "w") as dest:
+                    for info in src.infolist():
+                        if info.filename == record:
+                            continue
+                        if info.filename == f"{dist_info}/METADATA":
+                            dest.writestr(_new_zip_info(info, rename(info.filename)), metadata)
+                        else:
+                            _copy_zip_member(src, dest, info, rename(info.filename))
 
-def download_wheel(url, destdir):
-    local_filename = os.path.basename(url)
-    path = os.path.join(destdir, local_filename)
+                    record_rows = update_record(
+                        src.read(record), rename, {f"{dist_info}/METADATA": metadata}, record
+                    )
+                    dest.writestr(_new_zip_info(src.getinfo(record), rename(record)), record_rows)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, wheel_path)
+    return wheel_path
 
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        r.raw.decode_content = True
-        with open(path, "wb") as f:
-            shutil.copyfileobj(r.raw, f)
-    return path
 
+def update_record(record: bytes, rename, changed: Dict[str, bytes], record_name: str) -> bytes:
+    """
+    Rewrite the RECORD of a wheel: apply ``rename`` to every path, and
+    recompute hash and size of the files in ``changed``. Hashes of the other
+    files are kept as they are, as their contents don't change.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    for row in csv.reader(io.StringIO(record.decode("utf-8"))):
+        if not row:
+            continue
+        path = row[0]
+        if path == record_name:
+            row = [path, "", ""]
+        elif path in changed:
+            digest = urlsafe_b64encode(hashlib.sha256(changed[path]).digest()).rstrip(b"=")
+            row = [path, "sha256=" + digest.decode("ascii"), str(len(changed[path]))]
+        writer.writerow([rename(path)] + row[1:])
+    return out.getvalue().encode("utf-8")
 
-def repack_wheel(output: str, url_or_path: str, local: bool = False):
-    with TemporaryDirectory() as tmp:
+
+def _new_zip_info(info: ZipInfo, arcname: str) -> ZipInfo:
+    """A fresh ZipInfo for a regenerated member, keeping the timestamp and mode of ``info``"""
+    new = ZipInfo(arcname, date_time=info.date_time)
+    new.external_attr = info.external_attr
+    new.compress_type = ZIP_DEFLATED
+    return new
+
+
+def _copy_zip_member(src: ZipFile, dest: ZipFile, info: ZipInfo, arcname: str):
+    """
+    Copy the member ``info`` of ``src`` into ``dest`` as ``arcname``, as raw
+    compressed bytes.
+
+    ZipFile has no public API to do this, so this writes the local file header
+    and the compressed data directly, and registers the entry with ``dest`` the
+    same way ``ZipFile.write`` does.
+    """
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(sizeFileHeader)
+    filename_length, extra_length = struct.unpack("<HH", header[26:30])
+    src.fp.seek(info.header_offset + sizeFileHeader + filename_length + extra_length)
+
+    new = copy.copy(info)
+    new.filename = new.orig_filename = arcname
+    # Sizes and CRC are known up-front, so they go in the local header instead
+    # of a trailing data descriptor
+    new.flag_bits &= ~0x08
+    new.header_offset = dest.fp.tell()
+    dest.fp.write(new.FileHeader())
+
+    remaining = info.compress_size
+    while remaining:
+        chunk = src.fp.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise EOFError(f"Truncated member {info.filename} in {src.filename}")
+        dest.fp.write(chunk)
+        remaining -= len(chunk)
+
+    dest.filelist.append(new)
+    dest.NameToInfo[arcname] = new
+    dest.start_dir = dest.fp.tell()
+    dest._didModify = True
+
+
+class RepackManifest:
+    """
+    Record of the wheels repacked into an output folder, stored in the folder
+    itself, so that re-running into the same folder only redoes new, stale or
+    failed wheels.
+
+    Remote wheels are keyed by URL and local wheels by path. A remote wheel is
+    stale when the ``#sha256=`` fragment of its URL no longer matches the hash
+    it was repacked from, and a local one when its size or mtime changed. An
+    entry is also redone when its output wheel is missing or has changed.
+    """
+
+    FILENAME = ".repackage-manifest.json"
+
+    def __init__(self, output: str):
+        self.output = output
+        self.path = os.path.join(output, self.FILENAME)
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path) as fh:
+                self.entries = json.load(fh)["wheels"]
+
+    @staticmethod
+    def key(url_or_path: str, local: bool) -> str:
         if local:
-            src_filename = os.path.join(tmp, os.path.basename(url_or_path))
-            shutil.copy(url_or_path, src_filename)
+            return os.path.abspath(url_or_path)
+        return urlsplit(url_or_path)._replace(fragment="").geturl()
+
+    def _source_state(self, url_or_path: str, local: bool) -> dict:
+        if local:
+            stat = os.stat(url_or_path)
+            return {"size": stat.st_size, "mtime": stat.st_mtime}
+        fragment = urlsplit(url_or_path).fragment
+        if fragment.startswith("sha256="):
+            return {"sha256": fragment[len("sha256="):].lower()}
+        return {}
+
+    def status(self, url_or_path: str, local: bool) -> str:
+        """Whether a wheel is ``new``, ``failed``, ``stale`` or ``done``"""
+        entry = self.entries.get(self.key(url_or_path, local))
+        if entry is None:
+            return "new"
+        if entry["status"] != "done":
+            return "failed"
+        source_state = self._source_state(url_or_path, local)
+        if any(entry.get(k) != v for k, v in source_state.items()):
+            return "stale"
+        output_wheel = os.path.join(self.output, entry["output"])
+        if not os.path.exists(output_wheel) or os.path.getsize(output_wheel) != entry["output_size"]:
+            return "stale"
+        return "done"
+
+    def record(
+        self,
+        url_or_path: str,
+        local: bool,
+        output_wheel: Optional[str],
+        sha256: Optional[str],
+        error: Optional[BaseException] = None,
+    ):
+        entry = {"source": url_or_path, **self._source_state(url_or_path, local)}
+        if sha256:
+            entry["sha256"] = sha256
+        if error is None:
+            entry.update(
+                status="done",
+                output=os.path.relpath(output_wheel, self.output),
+                output_size=os.path.getsize(output_wheel),
+                output_sha256=file_sha256(output_wheel),
+            )
         else:
-            src_filename = download_wheel(url_or_path, tmp)
+            entry.update(status="failed", error=repr(error))
+        self.entries[self.key(url_or_path, local)] = entry
+        self.save()
+
+    def output_hashes(self) -> Dict[str, str]:
+        """Map of output wheel path, relative to the output folder, to its sha256"""
+        return {
+            entry["output"]: entry["output_sha256"]
+            for entry in self.entries.values()
+            if entry["status"] == "done" and "output_sha256" in entry
+        }
+
+    def save(self):
+        with NamedTemporaryFile("w", dir=self.output, delete=False) as fh:
+            json.dump({"wheels": self.entries}, fh, indent=2, sort_keys=True)
+        os.replace(fh.name, self.path)
+
 
-        match = WHEEL_INFO_RE.match(src_filename)
-        namever = match.group("namever")
-        ver = match.group("ver")
-        destination = os.path.join(tmp, namever)
+def repack_wheels(output: str, wheels, cache: WheelCache, local: bool = False, jobs: int = 1):
+    """
+    Repack ``wheels`` on a pool of ``jobs`` worker threads, so that downloads
+    overlap with the unpack/rewrite/pack work of other wheels.
+
+    ``wheels`` is consumed lazily and at most ``2 * jobs`` wheels are in flight
+    at once. Yields ``(wheel, result, error)`` tuples as each wheel finishes,
+    in completion order: ``result`` is the ``(new wheel path, input sha256)``
+    returned by :func:`repack_wheel`, or None if repacking failed with ``error``.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+        wheels = iter(wheels)
+        exhausted = False
 
-        # We can't use WheelFile to unpack it, as the filename doesn't match
-        # always the contents (rc vs not)
-        with ZipFile(src_filename) as wf:
-            wf.extractall(destination)
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * jobs:
+                try:
+                    wheel = next(wheels)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(repack_wheel, output, wheel, cache, local)] = wheel
 
-        real_name = update_metadata(destination, "1!" + ver)
+            if not pending:
+                break
 
-        os.unlink(src_filename)
-        output = os.path.join(output, real_name)
-        os.mkdir(output)
-        pack_wheel(destination, output, None)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                wheel = pending.pop(future)
+                try:
+                    yield wheel, future.result(), None
+                except Exception as e:
+                    yield wheel, None, e
 
 
-def update_metadata(unpacked_folder, ver: str):
+def update_metadata(metadata_bytes: bytes, ver: str) -> Tuple[bytes, str, str]:
     """
-    Update the METADATA in the unpacked wheel folder, replacing requirements on
+    Update the contents of a wheel's METADATA file, replacing requirements on
     ``apache-airflow`` with ``astronomer-certified``.
 
     If we are repackaging the Apache Airflow RCs from dist.apache.org, the
     filename will contain rc1, but the version in the wheel will not match.
     This will update the version contained in the wheel to include the matching
     release candidate/pre-release version suffix
-    """
-    dist_info_path = glob(os.path.join(unpacked_folder, "*.dist-info"))[0]
 
-    with open(os.path.join(dist_info_path, "METADATA")) as fh:
-        metadata = Parser().parse(fh, headersonly=True)
+    Returns the new METADATA contents, the distribution name and the original
+    version from the METADATA.
+    """
+    metadata = Parser().parsestr(metadata_bytes.decode("utf-8"), headersonly=True)
 
     metadata_ver = metadata["Version"]
 
@@ -141,17 +784,189 @@ def update_metadata(unpacked_folder, ver: str):
 
     new_metadata.set_payload(metadata.get_payload())
 
-    with open(os.path.join(dist_info_path, "METADATA"), "w") as fh:
-        fh.write(new_metadata.as_string())
+    return new_metadata.as_string().encode("utf-8"), metadata["Name"], metadata_ver
 
-    if metadata_ver != ver:
-        # Update the version in the .dist-info/ folder name, as this is what
-        # `wheel pack` uses to create the filename
-        folder = os.path.basename(dist_info_path)
-        folder = folder.replace(metadata_ver, ver)
-        os.rename(dist_info_path, os.path.join(unpacked_folder, folder))
 
-    return metadata["Name"]
+PROJECT_INDEX_HTML = """<!DOCTYPE html>
+<html>
+  <head>
+    <meta name="pypi:repository-version" content="1.0">
+    <title>Links for {name}</title>
+  </head>
+  <body>
+    <h1>Links for {name}</h1>
+{links}
+  </body>
+</html>
+"""
+
+ROOT_INDEX_HTML = """<!DOCTYPE html>
+<html>
+  <head>
+    <meta name="pypi:repository-version" content="1.0">
+    <title>Simple index</title>
+  </head>
+  <body>
+{links}
+  </body>
+</html>
+"""
+
+
+def wheel_requires_python(path: str) -> Optional[str]:
+    """Read Requires-Python from the METADATA of a wheel, without extracting it"""
+    with ZipFile(path) as wf:
+        name = next(n for n in wf.namelist() if re.match(r"^[^/]+\.dist-info/METADATA$", n))
+        metadata = Parser().parsestr(wf.read(name).decode("utf-8"), headersonly=True)
+    return metadata["Requires-Python"]
+
+
+def write_if_changed(path: str, contents: str):
+    if os.path.exists(path):
+        with open(path) as fh:
+            if fh.read() == contents:
+                return
+    with NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as fh:
+        fh.write(contents)
+    os.replace(fh.name, path)
+
+
+def write_project_index(output: str, project: str, hashes: Dict[str, str]):
+    """
+    Write the PEP 503 (``index.html``) and PEP 691 (``index.json``) pages for
+    the wheels in ``output/project``. ``hashes`` maps wheel paths relative to
+    ``output`` to their sha256, for wheels we don't want to hash again.
+    """
+    files = []
+    for filename in sorted(os.listdir(os.path.join(output, project))):
+        if not filename.endswith(".whl"):
+            continue
+        path = os.path.join(output, project, filename)
+        files.append(
+            {
+                "filename": filename,
+                "url": quote(filename),
+                "hashes": {"sha256": hashes.get(os.path.join(project, filename)) or file_sha256(path)},
+                "requires-python": wheel_requires_python(path),
+            }
+        )
+
+    links = []
+    for f in files:
+        requires_python = ""
+        if f["requires-python"]:
+            requires_python = f' data-requires-python="{html.escape(f["requires-python"])}"'
+        links.append(
+            f'    <a href="{f["url"]}#sha256={f["hashes"]["sha256"]}"{requires_python}>'
+            f'{html.escape(f["filename"])}</a><br/>'
+        )
+
+    write_if_changed(
+        os.path.join(output, project, "index.html"),
+        PROJECT_INDEX_HTML.format(name=html.escape(project), links="\n".join(links)),
+    )
+    write_if_changed(
+        os.path.join(output, project, "index.json"),
+        json.dumps({"meta": {"api-version": "1.0"}, "name": project, "files": files}, indent=2) + "\n",
+    )
+
+
+def write_indexes(output: str, touched_projects: Set[str], hashes: Dict[str, str]) -> Set[str]:
+    """
+    Update the PEP 503/691 index pages of ``output``, so it can be used with
+    ``pip install --index-url file://...`` or uploaded as is.
+
+    Only the pages of ``touched_projects``, and of projects that have no pages
+    yet, are regenerated. Returns the projects that were (re)indexed.
+    """
+    projects = sorted(
+        name for name in os.listdir(output) if os.path.isdir(os.path.join(output, name))
+    )
+    reindex = {
+        project
+        for project in projects
+        if project in touched_projects or not os.path.exists(os.path.join(output, project, "index.html"))
+    }
+    for project in sorted(reindex):
+        write_project_index(output, project, hashes)
+
+    links = "\n".join(f'    <a href="{quote(p)}/">{html.escape(p)}</a><br/>' for p in projects)
+    write_if_changed(os.path.join(output, "index.html"), ROOT_INDEX_HTML.format(links=links))
+    write_if_changed(
+        os.path.join(output, "index.json"),
+        json.dumps({"meta": {"api-version": "1.0"}, "projects": [{"name": p} for p in projects]}, indent=2)
+        + "\n",
+    )
+    return reindex
+
+
+def repack_all(output: str, wheels, cache: WheelCache, local_dir: Optional[str], jobs: int):
+    """Repack ``wheels``, printing results as they finish. Returns the wheels that failed"""
+
+    has_unpatched_kubernetes_provider = False
+    local = bool(local_dir)
+    manifest = RepackManifest(output)
+    previous_status = {}
+
+    def wheels_to_repack():
+        nonlocal has_unpatched_kubernetes_provider
+        for wheel in wheels:
+            if "kubernetes" in wheel and not local_dir:
+                has_unpatched_kubernetes_provider = wheel
+                continue
+            previous_status[wheel] = manifest.status(wheel, local)
+            if previous_status[wheel] == "done":
+                continue
+            yield wheel
+
+    table = Table(title="Repackaged providers")
+    table.add_column("Provider Name", justify="right", style="cyan", no_wrap=True)
+    table.add_column("Source", style="magenta")
+    table.add_column("Version", justify="right", style="green")
+    table.add_column("Result")
+
+    failed = []
+    touched_projects = set()
+    results = repack_wheels(output, wheels_to_repack(), cache, local, jobs)
+    for wheel, result, error in results:
+        match = WHEEL_INFO_RE.match(wheel_filename(wheel))
+        if error is None:
+            output_wheel, sha256 = result
+            manifest.record(wheel, local, output_wheel, sha256)
+            touched_projects.add(os.path.basename(os.path.dirname(output_wheel)))
+            rich.print(f"[green]Repackaged[/green] {wheel} -> {output_wheel}")
+            result = f"[green]ok ({previous_status[wheel]})[/green]"
+        else:
+            manifest.record(wheel, local, None, None, error)
+            rich.print(f"[red]Failed[/red] {wheel}: {error!r}")
+            result = f"[red]{error!r}[/red]"
+            failed.append(wheel)
+        table.add_row(match.group("name"), wheel, match.group("ver"), result)
+
+    console = Console()
+    console.print(table)
+
+    with trace.stage("index", output):
+        reindexed = write_indexes(output, touched_projects, manifest.output_hashes())
+    if reindexed:
+        rich.print(f"Updated the index pages of {', '.join(sorted(reindexed))}")
+
+    counts = collections.Counter(previous_status.values())
+    rich.print(
+        f"{counts['done']} up to date, {counts['new']} new, {counts['stale']} stale and "
+        f"{counts['failed']} previously failed wheel(s); {len(failed)} failed in this run"
+    )
+
+    if has_unpatched_kubernetes_provider:
+        print()
+        print(
+            f"\033[31m '{has_unpatched_kubernetes_provider}' needs to be patched and released with Istio "
+            "commit. Example cherry-picked commit: \n"
+            "https://github.com/astronomer/airflow/commit/d2c42de0ae96637bb684a4b57d2b7ef99045f7c2"
+        )
+        print()
+
+    return failed
 
 
 def main():
@@ -163,10 +978,11 @@ def main():
     )
     parser.add_argument(
         "--http_root",
-        default="https://dist.apache.org/repos/dist/release/airflow/providers/",
+        action="append",
         help=(
             "Root folder containing versioned release folders, for example "
-            "https://dist.apache.org/repos/dist/release/airflow/providers/"
+            "https://dist.apache.org/repos/dist/release/airflow/providers/. Subfolders "
+            "are crawled too. Can be given multiple times"
         ),
     )
 
@@ -179,45 +995,84 @@ def main():
         "--output",
         help=(
             "Folder under which to create output folders, suitable for "
-            "uploading to a PEP-503 compatible repository"
+            "uploading to a PEP-503 compatible repository. PEP-503 and PEP-691 "
+            "index pages are kept up to date in it"
         ),
         default="tmp-packages",
     )
 
     parser.add_argument(
         "--version",
-        help="Version to download and repackage",
+        action="append",
+        help="Version to download and repackage. Can be given multiple times",
+    )
+
+    parser.add_argument(
+        "--index-url",
+        default=ASTRONOMER_PIP_INDEX,
+        help="PEP-503 index to check for providers that have already been repackaged",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=(
+            "Folder to cache index pages and downloaded wheels in, shared between runs and between "
+            "the URL and --local-dir modes. Pass an empty string to only cache for this run"
+        ),
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of wheels to download and repackage concurrently",
+    )
+
+    parser.add_argument(
+        "--trace",
+        help="Append a JSON line with the duration and size of every stage of every wheel to this file",
+    )
+
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=8,
+        help="Maximum number of concurrent requests while crawling the listings",
     )
 
     args = parser.parse_args()
 
-    os.mkdir(args.output)
-    version = args.version
+    os.makedirs(args.output, exist_ok=True)
+    versions = args.version or []
+    http_roots = args.http_root or [DEFAULT_HTTP_ROOT]
     local_dir = args.local_dir
+    jobs = max(args.jobs, 1)
+    max_connections = max(args.max_connections, 1)
 
-    if local_dir:
-        wheels = glob(os.path.join(local_dir, "**/*.whl"), recursive=True)
-        if args.version:
-            wheels = [whl for whl in wheels if version in whl]
-    else:
-        wheels = wheel_urls_from_listing(args.http_root, version)
+    session = make_session(max(jobs, max_connections))
+    if args.trace:
+        trace.open(args.trace)
+    with ExitStack() as stack:
+        stack.callback(trace.close)
+        cache_dir = args.cache_dir or stack.enter_context(TemporaryDirectory())
+        cache = WheelCache(cache_dir, session)
 
-    has_unpatched_kubernetes_provider = False
+        if local_dir:
+            wheels = glob(os.path.join(local_dir, "**/*.whl"), recursive=True)
+            if versions:
+                wheels = [whl for whl in wheels if any(version in whl for version in versions)]
+        else:
+            index = PackageIndex(args.index_url, session, args.cache_dir or None)
+            wheels = wheel_urls_from_listing(http_roots, versions, index, max_connections)
 
-    for wheel in wheels:
-        if "kubernetes" in wheel and not local_dir:
-            has_unpatched_kubernetes_provider = wheel
-            continue
-        repack_wheel(args.output, wheel, bool(local_dir))
+        failed = repack_all(args.output, wheels, cache, local_dir, jobs)
 
-    if has_unpatched_kubernetes_provider:
-        print()
-        print(
-            f"\033[31m '{has_unpatched_kubernetes_provider}' needs to be patched and released with Istio "
-            "commit. Example cherry-picked commit: \n"
-            "https://github.com/astronomer/airflow/commit/d2c42de0ae96637bb684a4b57d2b7ef99045f7c2"
-        )
-        print()
+    Console().print(trace.summary())
+
+    if failed:
+        sys.exit(f"Failed to repackage {len(failed)} wheel(s)")
 
 
 if __name__ == "__main__":